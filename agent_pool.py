@@ -0,0 +1,99 @@
+#
+# Pool of prepared agents, keyed by model and tool set.
+#
+# An agent is only ever used by one request at a time. When a request is
+# done, the agent's memory is reset and it is returned to the pool, ready
+# for the next request with the same model and tools.
+#
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import os
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, List, Optional, Sequence
+
+from llama_index.core.tools import BaseTool
+
+logger = logging.getLogger("agent-pool")
+
+AGENT_POOL_MAX_KEYS = int(os.environ.get("AGENT_POOL_MAX_KEYS", 64))
+AGENT_POOL_MAX_IDLE = int(os.environ.get("AGENT_POOL_MAX_IDLE", 4))
+
+def pool_key(model: Optional[str], urns: Sequence[str], tools: Sequence[BaseTool], kind: str = "react") -> Hashable:
+    """Returns the pool key for a 'kind' of agent using 'model' and 'tools' (resolved from 'urns').
+    The tool instances are part of the key so a refreshed tool definition
+    automatically leads to a new agent."""
+    return (kind, model, tuple(sorted((urn, id(t)) for urn, t in zip(urns, tools))))
+
+class AgentPool:
+    """LRU pool of idle agents"""
+
+    def __init__(self, max_keys: int = AGENT_POOL_MAX_KEYS, max_idle: int = AGENT_POOL_MAX_IDLE):
+        self.max_keys = max_keys
+        self.max_idle = max_idle
+        self._idle: OrderedDict[Hashable, List[Any]] = OrderedDict()
+        self.in_use = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.discarded = 0
+
+    @asynccontextmanager
+    async def agent(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> AsyncIterator[Any]:
+        """Lends an agent for 'key', creating a new one with 'factory' if none is idle"""
+        agent = self._take(key)
+        if agent is None:
+            self.misses += 1
+            agent = await factory()
+        else:
+            self.hits += 1
+        self.in_use += 1
+        try:
+            yield agent
+        except BaseException:
+            # don't trust the state of an agent which failed
+            self.discarded += 1
+            raise
+        else:
+            self._give_back(key, agent)
+        finally:
+            self.in_use -= 1
+
+    def clear(self):
+        self._idle.clear()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "keys": len(self._idle),
+            "idle": sum(len(a) for a in self._idle.values()),
+            "in_use": self.in_use,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            "evictions": self.evictions,
+            "discarded": self.discarded,
+        }
+
+    def _take(self, key: Hashable) -> Optional[Any]:
+        idle = self._idle.get(key)
+        if not idle:
+            return None
+        self._idle.move_to_end(key)
+        return idle.pop()
+
+    def _give_back(self, key: Hashable, agent: Any):
+        try:
+            agent.reset() # clean memory for the next request
+        except Exception as e:
+            logger.warning(f"cannot reset agent, discarding it - {e}")
+            self.discarded += 1
+            return
+        idle = self._idle.setdefault(key, [])
+        self._idle.move_to_end(key)
+        if len(idle) >= self.max_idle:
+            self.discarded += 1
+            return
+        idle.append(agent)
+        while len(self._idle) > self.max_keys:
+            _, evicted = self._idle.popitem(last=False)
+            self.evictions += len(evicted)
@@ -0,0 +1,125 @@
+#
+# Batch execution of requests read from a JSONL file.
+#
+# Every (non empty) line of the input file is a request. Requests are executed
+# concurrently, at most BATCH_CONCURRENCY at a time, in a single process, so
+# they all share the resolved tools, the agent pool and the caches. Each
+# outcome is appended to the output file as soon as it is available, i.e. in
+# completion order, as either
+#
+#   {"index": <line of the request>, "response": {...}}
+#   {"index": <line of the request>, "error": {...}}
+#
+# The output file doubles as the checkpoint. When a batch is run again with
+# the same output file, requests which already have a response are skipped
+# and failed ones are retried.
+#
+import asyncio
+import json
+import os
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterator, TextIO
+
+from pydantic import BaseModel
+
+logger = logging.getLogger("batch")
+
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+# log progress after this many completed requests
+BATCH_PROGRESS_EVERY = int(os.environ.get("BATCH_PROGRESS_EVERY", 100))
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    parse: Callable[[str], Any],
+    execute: Callable[[Any], Awaitable[BaseModel]],
+    on_error: Callable[[Exception], BaseModel],
+    concurrency: int = BATCH_CONCURRENCY,
+) -> dict[str, Any]:
+    """Execute every request in 'input_path' and append the outcomes to 'output_path'.
+    Lines are turned into requests by 'parse' and executed by 'execute', any
+    exception raised by either is reported as the result of 'on_error'."""
+    done = completed_indices(output_path)
+    if done:
+        logger.info(f"resuming batch '{input_path}', {len(done)} requests already completed")
+    stats = {"total": 0, "skipped": 0, "succeeded": 0, "failed": 0}
+    start = time.monotonic()
+    limit = asyncio.Semaphore(concurrency)
+    tasks: set[asyncio.Task] = set()
+
+    with _open_output(output_path) as out:
+        async def run_one(index: int, line: str):
+            try:
+                try:
+                    resp = await execute(parse(line))
+                    rec = {"index": index, "response": _dump(resp)}
+                    stats["succeeded"] += 1
+                except Exception as e:
+                    logger.info(f"batch request #{index} failed - {e}")
+                    rec = {"index": index, "error": _dump(on_error(e))}
+                    stats["failed"] += 1
+                out.write(json.dumps(rec) + "\n")
+                out.flush()
+                completed = stats["succeeded"] + stats["failed"]
+                if completed % BATCH_PROGRESS_EVERY == 0:
+                    logger.info(f"batch progress: {completed} completed ({stats['failed']} failed) in {time.monotonic() - start:.1f}s")
+            finally:
+                limit.release()
+
+        for index, line in _read_requests(input_path):
+            stats["total"] += 1
+            if index in done:
+                stats["skipped"] += 1
+                continue
+            # only read ahead as far as there are free slots
+            await limit.acquire()
+            task = asyncio.create_task(run_one(index, line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    stats["elapsed"] = time.monotonic() - start
+    logger.info(f"batch '{input_path}' done: {stats}")
+    return stats
+
+def completed_indices(output_path: str) -> set[int]:
+    """Returns the indices of all requests with a response in 'output_path'"""
+    done: set[int] = set()
+    try:
+        with open(output_path, 'r') as file:
+            for n, line in enumerate(file):
+                if not line.strip():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    # most likely cut short by a crash, the request is simply run again
+                    logger.warning(f"ignoring malformed line {n + 1} in '{output_path}'")
+                    continue
+                if "response" in rec:
+                    done.add(rec["index"])
+    except FileNotFoundError:
+        pass
+    return done
+
+### INTERNAL
+
+def _read_requests(path: str) -> Iterator[tuple[int, str]]:
+    with open(path, 'r') as file:
+        for index, line in enumerate(file):
+            if line.strip():
+                yield index, line
+
+def _open_output(path: str) -> TextIO:
+    out = open(path, 'a')
+    if out.tell() > 0:
+        with open(path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                out.write("\n") # terminate a line cut short by a crash
+    return out
+
+def _dump(m: BaseModel) -> dict[str, Any]:
+    return m.model_dump(mode="json", by_alias=True, exclude_none=True)
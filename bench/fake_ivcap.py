@@ -0,0 +1,91 @@
+#
+# A fake IVCAP for benchmarks, serving tool definitions and tool jobs.
+#
+# The runner is pointed at it through IVCAP_BASE_URL. Every service URN
+# resolves to a tool multiplying two integers, named after the last part of
+# the URN (e.g. 'urn:ivcap:service:bench.mul3' -> 'mul3'). Jobs take
+# '--latency' seconds and are answered right away (200), except for a
+# '--accepted-ratio' share which is accepted (202) and then has to be polled
+# for '--job-time' seconds until it succeeds.
+#
+import argparse
+import asyncio
+import random
+import re
+import time
+from typing import Any, Dict
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+app = FastAPI(title="Fake IVCAP")
+
+opts = argparse.Namespace(latency=0.1, accepted_ratio=0.0, job_time=1.0)
+calls = {"aspects": 0, "jobs": 0, "accepted": 0, "polls": 0}
+
+@app.get("/1/aspects")
+async def aspects(entity: str):
+    calls["aspects"] += 1
+    return {"items": [{"content": _tool_definition(entity)}]}
+
+@app.post("/1/services2/{urn}/jobs")
+async def create_job(urn: str, args: Dict[str, Any], request: Request):
+    calls["jobs"] += 1
+    await asyncio.sleep(opts.latency)
+    result = args.get("a", 0) * args.get("b", 0)
+    if random.random() >= opts.accepted_ratio:
+        return result
+    calls["accepted"] += 1
+    job_id = str(uuid4())
+    _jobs[job_id] = (time.monotonic() + opts.job_time, result)
+    location = f"{str(request.base_url).rstrip('/')}/1/jobs/{job_id}"
+    return JSONResponse({"location": location, "retry-later": 10}, status_code=202)
+
+@app.get("/1/jobs/{job_id}")
+async def get_job(job_id: str):
+    calls["polls"] += 1
+    done_at, result = _jobs[job_id]
+    if time.monotonic() < done_at:
+        return {"status": "executing"}
+    del _jobs[job_id]
+    return {"status": "succeeded", "result-content": result}
+
+@app.get("/calls")
+def get_calls():
+    return calls
+
+### INTERNAL
+
+_jobs: dict[str, tuple[float, Any]] = {}
+
+def _tool_definition(urn: str) -> dict:
+    name = re.sub(r"\W", "_", re.split(r"[:.]", urn)[-1])
+    return {
+        "$schema": "urn:sd-core:schema:ai-tool.1",
+        "id": urn,
+        "name": name,
+        "service-id": urn,
+        "description": "Multiply two integers and returns the result integer",
+        "fn_signature": f"{name}(a: int, b: int) -> int",
+        "fn_schema": {
+            "properties": {
+                "a": {"title": "A", "type": "integer"},
+                "b": {"title": "B", "type": "integer"},
+            },
+            "required": ["a", "b"],
+            "title": name,
+            "type": "object",
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=app.title)
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8793)
+    parser.add_argument('--latency', type=float, default=0.1, help='Time in seconds a job submission takes')
+    parser.add_argument('--accepted-ratio', type=float, default=0.0, help='Share of jobs answered with 202 Accepted')
+    parser.add_argument('--job-time', type=float, default=1.0, help='Time in seconds until an accepted job succeeds')
+    opts = parser.parse_args()
+    uvicorn.run(app, host=opts.host, port=opts.port, log_level="warning")
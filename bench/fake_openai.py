@@ -0,0 +1,103 @@
+#
+# A fake OpenAI compatible chat completion endpoint for benchmarks.
+#
+# The runner is pointed at it through LITELLM_PROXY. It plays back scripted
+# agent conversations: each run calls tools for a number of steps, and then
+# answers with the last tool result. The number of steps is taken from a
+# 'steps=<n>' in the query (default '--steps'). Every completion takes
+# '--latency' seconds (+/- '--jitter').
+#
+# ReAct agents cycle through the tools listed in the system prompt, one tool
+# per step. Function calling agents (requests with 'tools') call all their
+# tools in every step.
+#
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI
+import uvicorn
+
+app = FastAPI(title="Fake OpenAI")
+
+opts = argparse.Namespace(latency=0.5, jitter=0.2, steps=1)
+calls = {"completions": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: Dict[str, Any]):
+    messages = body["messages"]
+    delay = opts.latency * (1 + random.uniform(-opts.jitter, opts.jitter))
+    await asyncio.sleep(max(0, delay))
+    if body.get("tools"):
+        message = _function_calling_step(messages, [t["function"]["name"] for t in body["tools"]])
+    else:
+        message = _react_step(messages)
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+    completion_tokens = len(str(message.get("content") or "")) // 4 + 1
+    calls["completions"] += 1
+    calls["prompt_tokens"] += prompt_tokens
+    calls["completion_tokens"] += completion_tokens
+    return {
+        "id": f"chatcmpl-{calls['completions']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+@app.get("/calls")
+def get_calls():
+    return calls
+
+### INTERNAL
+
+def _steps(messages: List[dict]) -> int:
+    query = next((m["content"] for m in messages if m["role"] == "user"), "") or ""
+    m = re.search(r"steps=(\d+)", query)
+    return int(m.group(1)) if m else opts.steps
+
+def _react_step(messages: List[dict]) -> dict:
+    text = "\n".join(str(m.get("content") or "") for m in messages)
+    observations = re.findall(r"Observation: (.*)", text)
+    tools = re.findall(r"> Tool Name: (\S+)", text)
+    step = len(observations)
+    if step >= _steps(messages) or not tools:
+        answer = observations[-1] if observations else "42"
+        return {"role": "assistant", "content": f"Thought: I can answer without using any more tools.\nAnswer: {answer}"}
+    tool = tools[step % len(tools)]
+    args = json.dumps({"a": step + 2, "b": 3})
+    return {"role": "assistant", "content": f"Thought: I need to use a tool.\nAction: {tool}\nAction Input: {args}"}
+
+def _function_calling_step(messages: List[dict], tools: List[str]) -> dict:
+    results = [str(m.get("content")) for m in messages if m["role"] == "tool"]
+    step = sum(1 for m in messages if m["role"] == "assistant" and m.get("tool_calls"))
+    if step >= _steps(messages):
+        return {"role": "assistant", "content": f"The results are {', '.join(results) or 'none'}"}
+    tool_calls = [
+        {
+            "id": f"call_{step}_{i}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps({"a": step + 2, "b": i + 1})},
+        }
+        for i, name in enumerate(tools)
+    ]
+    return {"role": "assistant", "content": None, "tool_calls": tool_calls}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=app.title)
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8792)
+    parser.add_argument('--latency', type=float, default=0.5, help='Mean time in seconds a completion takes')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Max. relative deviation from the mean latency')
+    parser.add_argument('--steps', type=int, default=1, help="Tool calling steps per run, unless the query contains 'steps=<n>'")
+    opts = parser.parse_args()
+    uvicorn.run(app, host=opts.host, port=opts.port, log_level="warning")
@@ -0,0 +1,209 @@
+#
+# Offline load test of the runner.
+#
+# Starts a fake OpenAI endpoint (fake_openai.py), a fake IVCAP (fake_ivcap.py)
+# and the runner (service.py) pointed at both, and then sends queries to
+# 'POST /' for every combination of concurrency, number of tools and number
+# of agent steps requested. Latency percentiles, requests per second and the
+# runner's memory (RSS) are written as JSON, so runs of different versions
+# can be compared.
+#
+#   python bench/load.py --concurrency 1,8,32 --tools 1,4 --steps 1,3 --output bench.json
+#
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+import httpx
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(bench_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the agent runner")
+    parser.add_argument('--concurrency', type=str, default="1,8,32", help='Comma separated list of concurrent clients')
+    parser.add_argument('--tools', type=str, default="1,4", help='Comma separated list of the number of tools per request')
+    parser.add_argument('--steps', type=str, default="1,3", help='Comma separated list of the number of agent steps per request')
+    parser.add_argument('--requests', type=int, default=100, help='Number of requests per scenario')
+    parser.add_argument('--parallel-tools', action="store_true", help="Send requests with 'parallel_tools' set")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Mean time in seconds an LLM completion takes')
+    parser.add_argument('--tool-latency', type=float, default=0.1, help='Time in seconds a tool job submission takes')
+    parser.add_argument('--accepted-ratio', type=float, default=0.0, help='Share of tool jobs answered with 202 Accepted')
+    parser.add_argument('--job-time', type=float, default=1.0, help='Time in seconds until an accepted tool job succeeds')
+    parser.add_argument('--port', type=int, default=8790, help='Port of the runner, the fakes use the next two')
+    parser.add_argument('--output', type=str, help='File to write the results to (default: stdout)')
+    parser.add_argument('--log', type=str, default=os.devnull, help='File to write the output of the runner and the fakes to')
+    parser.add_argument('service_args', nargs="*", help="Additional arguments for 'service.py' (after '--')")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(out + "\n")
+    else:
+        print(out)
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    started_at = datetime.now(timezone.utc).isoformat()
+    runner_url = f"http://127.0.0.1:{args.port}"
+    llm_url = f"http://127.0.0.1:{args.port + 1}"
+    ivcap_url = f"http://127.0.0.1:{args.port + 2}"
+    log = open(args.log, 'a')
+    procs = [
+        _start([os.path.join(bench_dir, "fake_openai.py"), "--port", str(args.port + 1),
+                "--latency", str(args.llm_latency)], log),
+        _start([os.path.join(bench_dir, "fake_ivcap.py"), "--port", str(args.port + 2),
+                "--latency", str(args.tool_latency), "--accepted-ratio", str(args.accepted_ratio),
+                "--job-time", str(args.job_time)], log),
+    ]
+    env = dict(os.environ, LITELLM_PROXY=llm_url, IVCAP_BASE_URL=ivcap_url)
+    runner = _start([os.path.join(project_dir, "service.py"), "--port", str(args.port), *args.service_args], log, env)
+    procs.append(runner)
+    try:
+        await _wait_ready([f"{llm_url}/calls", f"{ivcap_url}/calls", f"{runner_url}/_healtz"], procs)
+        results = []
+        scenarios = itertools.product(_ints(args.concurrency), _ints(args.tools), _ints(args.steps))
+        for concurrency, tools, steps in scenarios:
+            r = await _run_scenario(runner_url, runner.pid, concurrency, tools, steps, args)
+            print(
+                f"concurrency={concurrency:<4} tools={tools:<3} steps={steps:<3} "
+                f"rps={r['rps']:7.2f} p50={r['latency']['p50']:.3f}s p95={r['latency']['p95']:.3f}s "
+                f"p99={r['latency']['p99']:.3f}s errors={r['errors']} rss={r['rss_mb']['peak']}MB",
+                file=sys.stderr,
+            )
+            results.append(r)
+        async with httpx.AsyncClient() as client:
+            stats = (await client.get(f"{runner_url}/_stats")).json()
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        log.close()
+    return {
+        "started_at": started_at,
+        "version": os.environ.get("VERSION"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output",)},
+        "results": results,
+        "runner_stats": stats,
+    }
+
+### INTERNAL
+
+async def _run_scenario(url: str, pid: int, concurrency: int, tools: int, steps: int, args: argparse.Namespace) -> Dict[str, Any]:
+    urns = [f"urn:ivcap:service:bench.tool{i}" for i in range(tools)]
+    counter = itertools.count()
+
+    def body() -> Dict[str, Any]:
+        # unique messages, so neither caching nor coalescing can shortcut a request
+        return {"msg": f"benchmark request {next(counter)} steps={steps}", "tools": urns, "parallel_tools": args.parallel_tools}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=600, headers={"Timeout": "600"}) as client:
+        # warm up (resolve the tools, create the first agent) outside of the measurement
+        await client.post("/", json=body())
+
+        latencies: List[float] = []
+        errors = 0
+        remaining = itertools.count()
+
+        async def worker():
+            nonlocal errors
+            while next(remaining) < args.requests:
+                start = time.perf_counter()
+                try:
+                    resp = await client.post("/", json=body())
+                    ok = resp.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors += 1
+
+        rss_start = _rss_mb(pid)
+        peak = [rss_start]
+        sampling = asyncio.create_task(_sample_rss(pid, peak))
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        sampling.cancel()
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "tools": tools,
+        "steps": steps,
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0,
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0,
+        },
+        "rss_mb": {"start": rss_start, "peak": peak[0]},
+    }
+
+def _percentile(values: List[float], p: float) -> float:
+    # nearest rank on a sorted list
+    if not values:
+        return 0
+    k = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[k]
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status", 'r') as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None # not on Linux
+
+async def _sample_rss(pid: int, peak: List[Optional[float]]):
+    while True:
+        rss = _rss_mb(pid)
+        if rss is not None and (peak[0] is None or rss > peak[0]):
+            peak[0] = rss
+        await asyncio.sleep(0.1)
+
+def _ints(s: str) -> List[int]:
+    return [int(v) for v in s.split(",") if v.strip()]
+
+def _start(cmd: List[str], log: TextIO, env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *cmd], env=env, cwd=project_dir, stdout=log, stderr=subprocess.STDOUT)
+
+async def _wait_ready(urls: List[str], procs: List[subprocess.Popen], timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        for url in urls:
+            while True:
+                if any(p.poll() is not None for p in procs):
+                    raise RuntimeError("a benchmark process exited during startup")
+                try:
+                    if (await client.get(url)).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"'{url}' not ready after {timeout}s")
+                await asyncio.sleep(0.2)
+
+if __name__ == "__main__":
+    main()
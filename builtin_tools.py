@@ -19,36 +19,36 @@ def addInt(a: int, b: int) -> int:
        The addition of the two input numbers
     """
     return a + b
-register_builtin_tool(addInt)
+register_builtin_tool(addInt, deterministic=True)
 
 def addFloat(a: float, b: float) -> float:
     """Add two float numbers and returns the result as float"""
     return a + b
-register_builtin_tool(addFloat)
+register_builtin_tool(addFloat, deterministic=True)
 
 ### MULTIPLY
 
 def mulInt(a: int, b: int) -> int:
     """Multiply two integers and returns the result integer"""
     return a * b
-register_builtin_tool(mulInt)
+register_builtin_tool(mulInt, deterministic=True)
 
 def mulFloat(a: int, b: int) -> int:
     """Multiply two float numbers and returns the result as float"""
     return a * b
-register_builtin_tool(mulFloat)
+register_builtin_tool(mulFloat, deterministic=True)
 
 ### DIVIDE
 
 def divInt(a: int, b: int) -> int:
     """Divide two integers and returns the result integer"""
     return a * b
-register_builtin_tool(divInt)
+register_builtin_tool(divInt, deterministic=True)
 
 def divFloat(a: int, b: int) -> int:
     """Divide two float numbers and returns the result as float"""
     return a * b
-register_builtin_tool(divFloat)
+register_builtin_tool(divFloat, deterministic=True)
 
 if __name__ == "__main__":
     import logging
@@ -0,0 +1,118 @@
+#
+# Coalescing of identical in-flight requests.
+#
+# Dashboards and retrying clients often send the same query several times
+# within seconds. While a run for a key is in flight, later runs with the same
+# key don't execute again but wait for the first one and share its result (or
+# exception). The shared run is only cancelled once all of its callers have
+# gone away. Nothing is kept after the run finished, so this is not a cache.
+#
+# A run can also be reserved for a request which was admitted (with a ticket
+# of the scheduler), but isn't executing yet. Identical requests arriving in
+# the meantime then join it rather than being admitted themselves, and the
+# run is started with the reserved ticket by whichever of them executes first.
+#
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger("coalescing")
+
+T = TypeVar("T")
+
+class InFlight:
+    """Runs in flight by key"""
+
+    def __init__(self):
+        self._runs: dict[str, _Run] = {}
+        self.runs = 0
+        self.joined = 0
+        self.reserved = 0
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[Any], Awaitable[T]],
+        ticket: Any = None,
+        on_join: Optional[Callable[[], None]] = None,
+        release: Optional[Callable[[Any], None]] = None,
+    ) -> T:
+        """Returns the result of 'fn(ticket)', or of the run already in flight
+        for 'key'. A reserved run is started with its reserved ticket instead.
+        'on_join' is called when joining a run in flight, 'release' with
+        'ticket' if it isn't used by the run."""
+        r = self._runs.get(key)
+        if r is None:
+            r = self._runs[key] = _Run(ticket)
+        if r.task is None:
+            r.task = asyncio.ensure_future(fn(r.ticket))
+            r.task.add_done_callback(lambda _: self._finished(key, r))
+            self.runs += 1
+        else:
+            r.joined += 1
+            self.joined += 1
+            logger.debug(f"joining run {key[:12]} ({r.joined} joined)")
+            if on_join is not None:
+                on_join()
+        if ticket is not None and ticket is not r.ticket and release is not None:
+            release(ticket)
+        r.waiters += 1
+        try:
+            return await asyncio.shield(r.task)
+        except asyncio.CancelledError:
+            if r.waiters == 1 and not r.task.done():
+                r.task.cancel() # nobody else is interested
+            raise
+        finally:
+            r.waiters -= 1
+
+    def has(self, key: str) -> bool:
+        """Returns true if a run for 'key' is in flight or reserved"""
+        return key in self._runs
+
+    def reserve(self, key: str, ticket: Any):
+        """Reserve the run for 'key' for a request admitted with 'ticket'"""
+        if key not in self._runs:
+            self._runs[key] = _Run(ticket)
+            self.reserved += 1
+
+    def release(self, key: str, ticket: Any):
+        """Drop the reservation of 'key' with 'ticket' if its run never started"""
+        r = self._runs.get(key)
+        if r is not None and r.task is None and r.ticket is ticket:
+            del self._runs[key]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "in_flight": len(self._runs),
+            "runs": self.runs,
+            "joined": self.joined,
+            "reserved": self.reserved,
+        }
+
+    def _finished(self, key: str, r: "_Run"):
+        if self._runs.get(key) is r:
+            del self._runs[key]
+
+def request_key(d: dict[str, Any]) -> str:
+    """Returns a canonical hash of a request 'd'"""
+    s = json.dumps(d, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(s.encode()).hexdigest()
+
+def stats() -> dict[str, Any]:
+    return in_flight.stats()
+
+in_flight = InFlight()
+
+### INTERNAL
+
+class _Run:
+    __slots__ = ("ticket", "task", "waiters", "joined")
+
+    def __init__(self, ticket: Any):
+        self.ticket = ticket
+        self.task: Optional[asyncio.Future] = None # None while only reserved
+        self.waiters = 0
+        self.joined = 0
@@ -2,7 +2,7 @@
 from __future__ import annotations
 from datetime import datetime
 from enum import Enum
-from typing import Any, Callable, ClassVar, Dict, ForwardRef, Optional, TypeAlias
+from typing import Any, Callable, ClassVar, Dict, ForwardRef, Iterable, Optional, Sequence, TypeAlias
 import llama_index.core.instrumentation as instrument
 
 from llama_index.core.instrumentation.event_handlers.base import BaseEventHandler
@@ -23,7 +23,11 @@ from llama_index.core.base.llms.types import  MessageRole
 
 from llama_index.core.bridge.pydantic import BaseModel, Field, ConfigDict
 from uuid import UUID, uuid4
-import threading
+from contextvars import ContextVar
+from collections import OrderedDict
+import os
+import sys
+import time
 import logging
 from utils import SchemaModel
 
@@ -52,23 +56,141 @@ def create_event_id() -> UUID:
 def dispatch_event(ev: AgentEvent):
     _event_handler.event(ev)
 
-def register_event_handler(ev_handler: EventHandler) -> EventHandler:
-    """use 'ev_handler' to report all events issued on this particular thread"""
-    return _event_handler.register_event_handler(ev_handler)
-
-def unregister_event_handler(ev_handler: EventHandler):
-    _event_handler.unregister_event_handler(ev_handler)
+def has_subscriber() -> bool:
+    """Returns true if events issued in the current context are reported to a handler"""
+    return _event_handler.has_subscriber()
+
+def materialize(ev: Any) -> Optional[BaseModel]:
+    """Event handlers receive 'EventRecord's, this returns their 'AgentEvent' form.
+    Anything else is returned unchanged."""
+    if isinstance(ev, EventRecord):
+        return ev.materialize()
+    return ev
+
+def register_event_handler(ev_handler: EventHandler, delta_messages: bool = False) -> UUID:
+    """use 'ev_handler' to report all events issued in the current (async) context,
+    including all tasks started from it after this call. Returns the id of the
+    subscription, to be passed to 'unregister_event_handler'. The same handler
+    may well be registered by several runs at once.
+
+    If 'delta_messages' is set, LLM events only carry the messages added since
+    the previous LLM event of the run (see 'rebuild_transcript')"""
+    return _event_handler.register_event_handler(ev_handler, delta_messages)
+
+def unregister_event_handler(subscription: UUID):
+    _event_handler.unregister_event_handler(subscription)
+
+def rebuild_transcript(events: Iterable[Any]) -> list[LLMChatEvent]:
+    """Returns all LLM events in 'events' (in the order they were issued) with
+    their full list of 'requests', undoing any delta encoding.
+
+    'events' may contain 'AgentEvent's, 'EventRecord's or their JSON (dict) form."""
+    full: dict[int, list[LLMMessage]] = {}
+    result = []
+    for ev in events:
+        ev = materialize(ev)
+        if isinstance(ev, dict):
+            if ev.get("$schema") != LLMChatEvent.SCHEMA:
+                continue
+            ev = LLMChatEvent.model_validate(ev)
+        if not isinstance(ev, LLMChatEvent):
+            continue
+        if ev.seq is not None:
+            requests = ev.requests
+            if ev.base is not None:
+                prev = full.get(ev.base)
+                if prev is None:
+                    raise ValueError(f"LLM event '{ev.id}' refers to missing event #{ev.base}")
+                requests = prev[:ev.offset] + requests
+            full[ev.seq] = requests
+            ev = ev.model_copy(update={"requests": requests, "base": None, "offset": 0})
+        result.append(ev)
+    return result
+
+def stats() -> dict[str, Any]:
+    """Returns the number of active handlers as well as the number and
+    approximate memory of all open spans"""
+    return _event_handler.stats()
 
 ### INTERNAL
 
 
+class EventRecord:
+    """Compact internal representation of an event.
+
+    Creating the pydantic 'AgentEvent' (and stringifying arguments, copying
+    messages, ...) is deferred until a subscriber actually consumes the event.
+    """
+    __slots__ = ("factory", "args", "_event")
+
+    def __init__(self, factory: Callable[..., AgentEvent], *args):
+        self.factory = factory
+        self.args = args
+        self._event = None
+
+    def materialize(self) -> Optional[AgentEvent]:
+        if self._event is None and self.factory is not None:
+            try:
+                self._event = self.factory(*self.args)
+            except Exception as e:
+                logger.error(f"handler: creating event: {e}")
+            self.factory = self.args = None # release references
+        return self._event
+
 class Status(Enum):
     STARTED = "started"
     IN_PROGRESS = "in-progress"
     FINISHED = "finished"
     ERROR = "error"
 
-span2ctxt: dict[str, any] = {}
+SPAN_STORE_MAX_SIZE = int(os.environ.get("SPAN_STORE_MAX_SIZE", 1024))
+SPAN_TTL = float(os.environ.get("SPAN_TTL", 900))
+
+class SpanStore:
+    """Maps open llama_index spans to the context of their start event.
+
+    Every agent run has its own store, which is dropped when the run ends.
+    Spans whose end event never arrives (errors, cancellation) expire after
+    SPAN_TTL seconds, and the store never holds more than SPAN_STORE_MAX_SIZE spans.
+    """
+    __slots__ = ("max_size", "ttl", "_spans", "expired")
+
+    def __init__(self, max_size: int = SPAN_STORE_MAX_SIZE, ttl: float = SPAN_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._spans: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.expired = 0
+
+    def put(self, span_id: str, ctxt: Any):
+        now = time.monotonic()
+        self._spans[span_id] = (now, ctxt)
+        self._spans.move_to_end(span_id)
+        self.expire(now)
+
+    def pop(self, span_id: str, default: Any = None) -> Any:
+        e = self._spans.pop(span_id, None)
+        return e[1] if e is not None else default
+
+    def expire(self, now: Optional[float] = None):
+        # spans are kept in insertion order, so the oldest are always at the front
+        deadline = (now or time.monotonic()) - self.ttl
+        while self._spans:
+            span_id, (ts, _) = next(iter(self._spans.items()))
+            if ts > deadline and len(self._spans) <= self.max_size:
+                break
+            del self._spans[span_id]
+            self.expired += 1
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self._spans) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, (_, v) in self._spans.items())
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+# identifies the event handler of the agent run executing in the current context
+_current_qid: ContextVar[Optional[UUID]] = ContextVar("event_handler_qid", default=None)
+_current_eid: ContextVar[Optional[UUID]] = ContextVar("event_id", default=None)
 
 class AgentEvent(SchemaModel):
     SCHEMA: ClassVar[str] = "urn:sd-core:schema:llama-agent.event.agent.1"
@@ -87,7 +209,7 @@ class LLMMessage(BaseModel):
 
     @classmethod
     def from_chat_message(cls, m: ChatMessage):
-        content=m.content
+        content=m.content or "" # e.g. function calling requests have no content
         role=m.role.value
         if m.role == MessageRole.SYSTEM:
             content="** system **"
@@ -106,25 +228,27 @@ class LLMChatEvent(AgentEvent):
 
     requests: list[LLMMessage]
     response: Optional[LLMMessage] = None
+    # Only set in delta mode: 'seq' numbers the LLM events of a run, and
+    # 'requests' only holds the messages following the first 'offset'
+    # messages of LLM event 'base' (all of them if 'base' is not set)
+    seq: Optional[int] = None
+    base: Optional[int] = None
+    offset: Optional[int] = None
 
     @classmethod
-    def from_chat_start_event(cls, e: LLMChatStartEvent):
-        id = str(uuid4())
-        span2ctxt[e.span_id] = id
+    def from_chat_start_event(cls, e: LLMChatStartEvent, id: str, delta: Optional[MessageDelta] = None):
         ts = e.timestamp
-        requests = [LLMMessage.from_chat_message(m) for m in e.messages]
         return cls(
-            id=str(id),
+            id=id,
             status=Status.STARTED,
             timestamp=ts,
-            requests=requests,
-            response=None)
+            requests=cls._requests(e.messages, delta),
+            response=None,
+            **cls._delta_fields(delta))
 
     @classmethod
-    def from_chat_end_event(cls, e: LLMChatEndEvent):
-        id = span2ctxt.pop(e.span_id, None)
+    def from_chat_end_event(cls, e: LLMChatEndEvent, id: Optional[str], delta: Optional[MessageDelta] = None):
         ts = e.timestamp
-        requests = [LLMMessage.from_chat_message(m) for m in e.messages]
         if isinstance(e.response, ChatResponse):
             response = LLMMessage.from_chat_response(e.response)
         else:
@@ -133,8 +257,52 @@ class LLMChatEvent(AgentEvent):
             id=id,
             status=Status.FINISHED,
             timestamp=ts,
-            requests=requests,
-            response=response)
+            requests=cls._requests(e.messages, delta),
+            response=response,
+            **cls._delta_fields(delta))
+
+    @classmethod
+    def _requests(cls, messages: Sequence[ChatMessage], delta: Optional[MessageDelta]) -> list[LLMMessage]:
+        if delta is not None:
+            messages = messages[delta.offset:]
+        return [LLMMessage.from_chat_message(m) for m in messages]
+
+    @classmethod
+    def _delta_fields(cls, delta: Optional[MessageDelta]) -> dict[str, Any]:
+        if delta is None:
+            return {}
+        return dict(seq=delta.seq, base=delta.base, offset=delta.offset)
+
+class MessageDelta:
+    """Position of an LLM event's messages relative to the run's previous LLM event"""
+    __slots__ = ("seq", "base", "offset")
+
+    def __init__(self, seq: int, base: Optional[int], offset: int):
+        self.seq = seq
+        self.base = base
+        self.offset = offset
+
+class _MessageLog:
+    """Remembers the messages of the last LLM event of a run, to compute the next delta"""
+    __slots__ = ("seq", "last")
+
+    def __init__(self):
+        self.seq = 0
+        self.last: list[tuple[Any, Any]] = []
+
+    def delta(self, messages: Sequence[ChatMessage]) -> MessageDelta:
+        # the ReAct formatter creates new message objects for every step,
+        # so compare the content, not the identity
+        keys = [(m.role, m.content) for m in messages]
+        last = self.last
+        n = min(len(keys), len(last))
+        offset = 0
+        while offset < n and keys[offset] == last[offset]:
+            offset += 1
+        base = self.seq if offset > 0 else None
+        self.seq += 1
+        self.last = keys
+        return MessageDelta(self.seq, base, offset)
 
 class ToolEvent(AgentEvent):
     SCHEMA: ClassVar[str] = "urn:sd-core:schema:llama-agent.event.tool.1"
@@ -142,6 +310,7 @@ class ToolEvent(AgentEvent):
     arguments: str
     response: Optional[Any] = None
     error: Optional[str] = None
+    cached: Optional[bool] = None # set if 'response' is a memoized result
 
     @classmethod
     def from_tool_event(cls, e: AgentToolCallEvent):
@@ -157,34 +326,41 @@ class ToolEvent(AgentEvent):
 
     @classmethod
     def dispatch_tool_start(cls, tool_name, **kwargs) -> str:
+        if not _event_handler.has_subscriber():
+            return ""
         id = str(uuid4())
-        ev = cls(
-                id=id,
-                status=Status.STARTED,
-                tool_name=tool_name,
-                arguments=str(kwargs))
-        _event_handler.event(ev)
+        _event_handler.event(EventRecord(cls._create, id, Status.STARTED, datetime.now(), tool_name, kwargs))
         return id
 
     @classmethod
     def dispatch_tool_end(cls, id, response, tool_name, **kwargs):
-        ev = cls(
-                id=id,
-                response=response,
-                status=Status.FINISHED,
-                tool_name=tool_name,
-                arguments=str(kwargs))
-        _event_handler.event(ev)
+        if not _event_handler.has_subscriber():
+            return
+        _event_handler.event(EventRecord(cls._create, id, Status.FINISHED, datetime.now(), tool_name, kwargs, response))
+
+    @classmethod
+    def dispatch_tool_cached(cls, id, response, tool_name, **kwargs):
+        if not _event_handler.has_subscriber():
+            return
+        _event_handler.event(EventRecord(cls._create, id, Status.FINISHED, datetime.now(), tool_name, kwargs, response, None, True))
 
     @classmethod
     def dispatch_tool_error(cls, id, err, tool_name, **kwargs):
-        ev = cls(
+        if not _event_handler.has_subscriber():
+            return
+        _event_handler.event(EventRecord(cls._create, id, Status.ERROR, datetime.now(), tool_name, kwargs, None, err))
+
+    @classmethod
+    def _create(cls, id, status, ts, tool_name, kwargs, response=None, err=None, cached=None):
+        return cls(
                 id=id,
-                status=Status.ERROR,
-                error=str(err),
+                status=status,
+                timestamp=ts,
+                response=response,
+                error=str(err) if err is not None else None,
+                cached=cached,
                 tool_name=tool_name,
                 arguments=str(kwargs))
-        _event_handler.event(ev)
 
 class Source(BaseModel):
     content: str
@@ -208,9 +384,7 @@ class StepEvent(AgentEvent):
     is_last: Optional[bool] = None
 
     @classmethod
-    def from_step_start_event(cls, e: AgentRunStepStartEvent):
-        id = e.step.step_id if e.step != None else uuid4()
-        span2ctxt[e.span_id] = id
+    def from_step_start_event(cls, e: AgentRunStepStartEvent, id: UUID):
         ts = e.timestamp
         return cls._from(id, Status.STARTED, ts)
 
@@ -250,31 +424,28 @@ class ChatEvent(AgentEvent):
     response: Optional[str] = None
 
     @classmethod
-    def from_chat_start_event(cls, e: AgentChatWithStepStartEvent):
+    def from_chat_start_event(cls, e: AgentChatWithStepStartEvent, id: str):
         ts = e.timestamp
-        id = str(uuid4())
-        ev = cls(
+        return cls(
             id=id,
             status=Status.STARTED,
             timestamp=ts,
             user_msg=e.user_msg,
         )
-        span2ctxt[e.span_id] = ev
-        return ev
 
     @classmethod
-    def from_chat_end_event(cls, e: AgentChatWithStepEndEvent):
-        ctxt = span2ctxt.pop(e.span_id, None)
+    def from_chat_end_event(cls, e: AgentChatWithStepEndEvent, ctxt: tuple[str, str]):
+        id, user_msg = ctxt
         ts = e.timestamp
         if isinstance(e.response, AgentChatResponse):
             response = e.response.response
         else:
             raise ValueError(f"Unexpected response type: {type(e.response)}")
         return cls(
-            id=ctxt.id,
+            id=id,
             status=Status.FINISHED,
             timestamp=ts,
-            user_msg=ctxt.user_msg,
+            user_msg=user_msg,
             response=response,
         )
 
@@ -284,34 +455,40 @@ class QueryEvent(AgentEvent):
     response: Optional[str] = None
 
     @classmethod
-    def from_query_start_event(cls, e: QueryStartEvent):
-        id = str(uuid4())
+    def from_query_start_event(cls, e: QueryStartEvent, id: str):
         ts = e.timestamp
-        ev = cls(
+        return cls(
             id=id,
             status=Status.STARTED,
             timestamp=ts,
             query=e.query
         )
-        span2ctxt[e.span_id] = ev
-        return ev
 
     @classmethod
-    def from_query_end_event(cls, e: QueryEndEvent):
-        ctxt = span2ctxt.pop(e.span_id, None)
+    def from_query_end_event(cls, e: QueryEndEvent, ctxt: tuple[str, str]):
+        id, query = ctxt
         ts = e.timestamp
         if isinstance(e.response, Response):
             response = e.response.response
         else:
             raise ValueError(f"Unexpected response type: {type(e.response)}")
         return cls(
-            id=ctxt.id,
+            id=id,
             status=Status.FINISHED,
             timestamp=ts,
-            query=ctxt.query,
+            query=query,
             response=response,
         )
 
+class _Subscription:
+    __slots__ = ("handler", "parent", "spans", "messages")
+
+    def __init__(self, handler: EventHandler, parent: Optional[UUID], delta_messages: bool = False):
+        self.handler = handler
+        self.parent = parent # handler active in the context before this one
+        self.spans = SpanStore()
+        self.messages = _MessageLog() if delta_messages else None
+
 class EventHandler(BaseEventHandler):
     @classmethod
     def class_name(cls) -> str:
@@ -321,29 +498,56 @@ class EventHandler(BaseEventHandler):
         super().__init__()
         self._events = {}
         self._ev_handlers = {}
-        self._thread_local = threading.local()
+        self._orphan_spans = SpanStore() # for events outside of any registered run
 
     def get_events(self, thread_id: str) -> list[AgentEvent]:
         return self._events.get(thread_id, [])
 
     def create_event_id(self) -> UUID:
         eid = uuid4()
-        self._thread_local.eid = eid
+        _current_eid.set(eid)
         return eid
 
-    def register_event_handler(self, ev_handler: EventHandler) -> EventHandler:
+    def register_event_handler(self, ev_handler: EventHandler, delta_messages: bool = False) -> UUID:
         qid = uuid4()
-        self._thread_local.qid = qid
-        self._ev_handlers[qid] = ev_handler
-        return ev_handler
-
-    def unregister_event_handler(self, ev_handler: EventHandler):
-        for qid, q in self._ev_handlers.items():
-            if q == ev_handler:
-                del self._ev_handlers[qid]
-                break
+        parent = _current_qid.get()
+        _current_qid.set(qid)
+        self._ev_handlers[qid] = _Subscription(ev_handler, parent, delta_messages)
+        return qid
+
+    def unregister_event_handler(self, qid: UUID):
+        sub = self._ev_handlers.pop(qid, None)
+        if sub is not None and _current_qid.get() == qid:
+            # restore whatever handler was active before
+            _current_qid.set(sub.parent)
+
+    def current_span_store(self) -> SpanStore:
+        sub = self._current_subscription()
+        return sub.spans if sub is not None else self._orphan_spans
+
+    def _current_subscription(self) -> Optional[_Subscription]:
+        qid = _current_qid.get()
+        return self._ev_handlers.get(qid) if qid is not None else None
+
+    def _message_delta(self, messages: Sequence[ChatMessage]) -> Optional[MessageDelta]:
+        # computed when the event is issued, as deltas depend on the order of events
+        sub = self._current_subscription()
+        if sub is None or sub.messages is None:
+            return None
+        return sub.messages.delta(messages)
+
+    def stats(self) -> dict[str, Any]:
+        stores = [sub.spans for sub in self._ev_handlers.values()] + [self._orphan_spans]
+        return {
+            "handlers": len(self._ev_handlers),
+            "spans": sum(len(s) for s in stores),
+            "span_bytes": sum(s.nbytes() for s in stores),
+            "expired_spans": sum(s.expired for s in stores),
+        }
 
     def handle(self, event: BaseEvent, **kwargs):
+        if not self.has_subscriber():
+            return # nobody is interested in events of this run, don't bother tracking spans
         try:
             ev = self._process_event(event)
         except Exception as e:
@@ -352,41 +556,62 @@ class EventHandler(BaseEventHandler):
         if ev is None: return
         self.event(ev)
 
-    def event(self, ev: AgentEvent):
-        qid = getattr(self._thread_local, "qid", None)
+    def event(self, ev: EventRecord):
+        qid = _current_qid.get()
         if qid is not None:
-            ev_handler = self._ev_handlers.get(qid, None)
-            if ev_handler is not None:
-                #asyncio.run_coroutine_threadsafe(ev_handler.put(ev), asyncio.get_running_loop())
-                # ev_handler.put(ev)
-                ev_handler(ev)
+            sub = self._ev_handlers.get(qid)
+            if sub is not None:
+                sub.handler(ev)
             else:
-                logger.warning(f"handler: EventHandler not found: {qid}")
+                logger.debug(f"handler: EventHandler not found: {qid}")
+
+    def has_subscriber(self) -> bool:
+        return _current_qid.get() in self._ev_handlers
 
-    def _process_event(self, event: BaseEvent) -> AgentEvent:
+    def _process_event(self, event: BaseEvent) -> Optional[EventRecord]:
+        # Only the span bookkeeping is done here, the actual AgentEvent
+        # is created by the EventRecord once a subscriber asks for it
+        spans = self.current_span_store()
         if isinstance(event, LLMChatStartEvent):
-            return LLMChatEvent.from_chat_start_event(event)
+            id = str(uuid4())
+            spans.put(event.span_id, id)
+            delta = self._message_delta(event.messages)
+            return EventRecord(LLMChatEvent.from_chat_start_event, event, id, delta)
         if isinstance(event, LLMChatEndEvent):
-            return LLMChatEvent.from_chat_end_event(event)
+            delta = self._message_delta(event.messages)
+            return EventRecord(LLMChatEvent.from_chat_end_event, event, spans.pop(event.span_id), delta)
 
         if isinstance(event, AgentToolCallEvent):
             # return ToolEvent.from_tool_event(event)
             return None # we now handle that directly
 
         if isinstance(event, AgentRunStepStartEvent):
-            return StepEvent.from_step_start_event(event)
+            id = event.step.step_id if event.step != None else uuid4()
+            spans.put(event.span_id, id)
+            return EventRecord(StepEvent.from_step_start_event, event, id)
         if isinstance(event, AgentRunStepEndEvent):
-            return StepEvent.from_step_end_event(event)
+            spans.pop(event.span_id)
+            return EventRecord(StepEvent.from_step_end_event, event)
 
         if isinstance(event, AgentChatWithStepStartEvent):
-            return ChatEvent.from_chat_start_event(event)
+            id = str(uuid4())
+            spans.put(event.span_id, (id, event.user_msg))
+            return EventRecord(ChatEvent.from_chat_start_event, event, id)
         if isinstance(event, AgentChatWithStepEndEvent):
-            return ChatEvent.from_chat_end_event(event)
+            ctxt = spans.pop(event.span_id)
+            if ctxt is None:
+                raise ValueError(f"Unknown or expired chat span '{event.span_id}'")
+            return EventRecord(ChatEvent.from_chat_end_event, event, ctxt)
 
         if isinstance(event, QueryStartEvent):
-            return QueryEvent.from_query_start_event(event)
+            id = str(uuid4())
+            spans.put(event.span_id, (id, event.query))
+            return EventRecord(QueryEvent.from_query_start_event, event, id)
         if isinstance(event, QueryEndEvent):
-            return QueryEvent.from_query_end_event(event)
+            ctxt = spans.pop(event.span_id)
+            if ctxt is None:
+                raise ValueError(f"Unknown or expired query span '{event.span_id}'")
+            return EventRecord(QueryEvent.from_query_end_event, event, ctxt)
 
         # ignore these events
         if isinstance(event, SpanDropEvent):
@@ -0,0 +1,87 @@
+#
+# Executors for builtin tools.
+#
+# Every builtin tool declares how it is executed:
+#
+#   inline    directly on the event loop (cheap functions, the default)
+#   thread    in a thread pool (blocking I/O, C extensions releasing the GIL)
+#   process   in a process pool (CPU bound python code)
+#
+# so an expensive tool never blocks other requests on the event loop.
+#
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import os
+import logging
+from typing import Any, Callable
+
+from utils import StrEnum
+
+logger = logging.getLogger("executors")
+
+class ExecutionClass(StrEnum):
+    Inline = "inline"
+    Thread = "thread"
+    Process = "process"
+
+def thread_workers() -> int:
+    return int(os.environ.get("TOOL_THREAD_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+def process_workers() -> int:
+    return int(os.environ.get("TOOL_PROCESS_WORKERS", os.cpu_count() or 1))
+
+async def run(execution: ExecutionClass, fn: Callable[..., Any], kwargs: dict[str, Any]) -> Any:
+    """Call 'fn' with 'kwargs' according to 'execution' and return its result"""
+    if execution == ExecutionClass.Inline:
+        return fn(**kwargs)
+    executor = _executor(execution)
+    s = _stats[execution]
+    s["active"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, **kwargs))
+    except BrokenProcessPool:
+        # a worker died (e.g. killed by the OOM killer), start with a fresh pool next time
+        logger.warning("process pool broken, restarting it")
+        _executors.pop(execution, None)
+        raise
+    finally:
+        s["active"] -= 1
+        s["completed"] += 1
+
+def shutdown():
+    """Called on app shutdown"""
+    for ex in _executors.values():
+        ex.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+
+def stats() -> dict[str, Any]:
+    return {
+        ec.value: dict(workers=_workers(ec), **_stats[ec])
+        for ec in (ExecutionClass.Thread, ExecutionClass.Process)
+    }
+
+### INTERNAL
+
+_executors: dict[ExecutionClass, Executor] = {}
+_stats = {
+    ec: {"active": 0, "completed": 0} # 'active' includes calls waiting for a worker
+    for ec in (ExecutionClass.Thread, ExecutionClass.Process)
+}
+
+def _workers(execution: ExecutionClass) -> int:
+    return thread_workers() if execution == ExecutionClass.Thread else process_workers()
+
+def _executor(execution: ExecutionClass) -> Executor:
+    # created on first use, so the pool sizes set on the command line apply
+    ex = _executors.get(execution)
+    if ex is None:
+        n = _workers(execution)
+        if execution == ExecutionClass.Thread:
+            ex = ThreadPoolExecutor(max_workers=n, thread_name_prefix="tool")
+        else:
+            ex = ProcessPoolExecutor(max_workers=n)
+        logger.info(f"Started {execution.value} pool with {n} workers for builtin tools")
+        _executors[execution] = ex
+    return ex
@@ -0,0 +1,114 @@
+#
+# Shared, connection-pooled HTTP clients for all remote tool traffic.
+#
+# A separate `httpx.AsyncClient` is kept per origin (scheme://host:port) so
+# that connection limits apply per host and keep-alive connections to the
+# IVCAP gateway are reused across tool calls and result polls.
+#
+import asyncio
+import os
+import logging
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger("http-client")
+
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", 50))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.environ.get("HTTP_MAX_KEEPALIVE_PER_HOST", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", 10))
+
+def _http2_available() -> bool:
+    if os.environ.get("HTTP2_ENABLED", "true").lower() in ("0", "false", "no"):
+        return False
+    try:
+        import h2  # noqa
+        return True
+    except ImportError:
+        return False
+
+HTTP2_ENABLED = _http2_available()
+
+class HostPool:
+    """A long-lived client for a single origin plus some bookkeeping on its use"""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(None, pool=HTTP_POOL_TIMEOUT)
+        self.client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=HTTP2_ENABLED)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            return await self.client.request(method, url, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict[str, Any]:
+        # httpcore does not expose pool occupancy publicly, so be defensive
+        pool = getattr(self.client._transport, "_pool", None)
+        conns = list(getattr(pool, "connections", []))
+        idle = sum(1 for c in conns if c.is_idle())
+        return {
+            "connections": len(conns),
+            "idle": idle,
+            "active": len(conns) - idle,
+            "waiting": max(0, self.in_flight - (len(conns) - idle)),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "max_connections": HTTP_MAX_CONNECTIONS_PER_HOST,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_pools: dict[str, HostPool] = {}
+
+def start():
+    """Called on app startup. Clients themselves are created lazily on first use."""
+    logger.info(f"HTTP client pool - max connections/host: {HTTP_MAX_CONNECTIONS_PER_HOST}, " +
+                f"keep-alive/host: {HTTP_MAX_KEEPALIVE_PER_HOST}, http2: {HTTP2_ENABLED}")
+
+async def close():
+    """Called on app shutdown to release all pooled connections."""
+    pools = list(_pools.values())
+    _pools.clear()
+    await asyncio.gather(*[p.aclose() for p in pools], return_exceptions=True)
+
+def get_pool(url: str) -> HostPool:
+    u = urlsplit(url)
+    origin = f"{u.scheme}://{u.netloc}"
+    pool = _pools.get(origin)
+    if pool is None:
+        pool = _pools[origin] = HostPool(origin)
+    return pool
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    return await get_pool(url).request(method, url, **kwargs)
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+def stats() -> dict[str, Any]:
+    return {
+        "http2": HTTP2_ENABLED,
+        "hosts": {origin: p.stats() for origin, p in _pools.items()},
+    }
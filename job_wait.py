@@ -0,0 +1,193 @@
+#
+# Waiting for the result of asynchronous (202 Accepted) IVCAP tool jobs.
+#
+# Jobs are polled starting with a short delay which then grows exponentially
+# (with jitter) up to JOB_POLL_MAX. A 'Retry-After' hint from the server takes
+# precedence, but never shortens a wait below JOB_POLL_INITIAL. Every wait is
+# bounded by the tightest of the default, per-tool and per-request deadlines.
+#
+# If JOB_CALLBACK_URL is set, job submissions also carry a callback URL which
+# IVCAP can POST the finished job to, so we don't need to wait for the next poll.
+#
+import asyncio
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+import os
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+import httpx
+
+import http_client
+
+logger = logging.getLogger("job-wait")
+
+JOB_POLL_INITIAL = float(os.environ.get("JOB_POLL_INITIAL", 0.25))
+JOB_POLL_MAX = float(os.environ.get("JOB_POLL_MAX", 10))
+JOB_POLL_MULTIPLIER = float(os.environ.get("JOB_POLL_MULTIPLIER", 2))
+JOB_POLL_JITTER = float(os.environ.get("JOB_POLL_JITTER", 0.2))
+JOB_DEADLINE = float(os.environ.get("JOB_DEADLINE", 600))
+# poll interval used while also waiting for a callback
+JOB_CALLBACK_POLL = float(os.environ.get("JOB_CALLBACK_POLL", 30))
+# public URL prefix of this service, e.g. 'http://runner.default.svc:8080'
+JOB_CALLBACK_URL = os.environ.get("JOB_CALLBACK_URL")
+JOB_CALLBACK_HEADER = "Job-Callback-Url"
+JOB_POLL_TIMEOUT = 5
+
+FAILED_STATES = ("failed", "error", "cancelled", "canceled")
+
+# per tool deadlines in seconds, e.g. JOB_TOOL_DEADLINES="slow_tool=1800,fast_tool=30"
+tool_deadlines: dict[str, float] = {
+    k.strip(): float(v) for k, v in
+    (e.split("=", 1) for e in os.environ.get("JOB_TOOL_DEADLINES", "").split(",") if "=" in e)
+}
+
+class JobWaitError(Exception):
+    pass
+
+class JobTimeoutError(JobWaitError):
+    pass
+
+def set_request_deadline(timeout: Optional[float]):
+    """Limit the time all job waits in the current request (context) may take in total"""
+    deadline = time.monotonic() + timeout if timeout else None
+    return _request_deadline.set(deadline)
+
+def reset_request_deadline(token):
+    _request_deadline.reset(token)
+
+def deadline_for(tool_name: str) -> float:
+    """Returns the absolute (monotonic) deadline for a job of 'tool_name' started now"""
+    now = time.monotonic()
+    deadline = now + tool_deadlines.get(tool_name, JOB_DEADLINE)
+    req_deadline = _request_deadline.get()
+    if req_deadline is not None:
+        deadline = min(deadline, req_deadline)
+    return deadline
+
+def create_callback() -> tuple[Optional[str], Dict[str, str]]:
+    """Returns a token and the headers to add to a job submission to have
+    the job's completion pushed back to us. Returns (None, {}) if callbacks are disabled."""
+    if not JOB_CALLBACK_URL:
+        return None, {}
+    token = str(uuid4())
+    _callbacks[token] = asyncio.get_running_loop().create_future()
+    url = f"{JOB_CALLBACK_URL.rstrip('/')}/_callbacks/jobs/{token}"
+    return token, {JOB_CALLBACK_HEADER: url}
+
+def release_callback(token: Optional[str]):
+    if token is not None:
+        _callbacks.pop(token, None)
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Returns the server's 'Retry-After' hint in seconds, if any"""
+    v = response.headers.get("retry-after")
+    if v is None:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+async def wait_for_job(
+    location: str,
+    tool_name: str,
+    *,
+    deadline: float,
+    retry_after: Optional[float] = None,
+    callback_token: Optional[str] = None,
+) -> Any:
+    """Wait for the job at 'location' to finish and return its result content.
+    Raises 'JobTimeoutError' if 'deadline' (monotonic) passes first."""
+    url = location + "?" + urlencode({"with-result-content": "true"})
+    callback = _callbacks.get(callback_token) if callback_token else None
+    backoff = JOB_POLL_INITIAL
+    delay = max(retry_after, JOB_POLL_INITIAL) if retry_after is not None else backoff
+    _stats["active"] += 1
+    started = time.monotonic()
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _stats["timeouts"] += 1
+                raise JobTimeoutError(f"job for tool '{tool_name}' did not finish in time - {location}")
+            delay = min(delay, remaining)
+            logger.debug(f"Waiting {delay:.2f}sec for result for tool {tool_name} - {location}")
+            if callback is not None:
+                try:
+                    job = await asyncio.wait_for(asyncio.shield(callback), delay)
+                    _stats["callbacks"] += 1
+                    return _job_result(job, tool_name, location)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(delay)
+
+            job, hint = await _poll(url, tool_name, location)
+            if job is not None:
+                return _job_result(job, tool_name, location)
+
+            backoff = min(backoff * JOB_POLL_MULTIPLIER, JOB_POLL_MAX)
+            delay = backoff * (1 + random.uniform(-JOB_POLL_JITTER, JOB_POLL_JITTER))
+            if callback is not None:
+                delay = max(delay, JOB_CALLBACK_POLL)
+            if hint is not None:
+                delay = max(hint, JOB_POLL_INITIAL) # 'Retry-After: 0' must not spin
+    finally:
+        _stats["active"] -= 1
+        _stats["wait_seconds"] += time.monotonic() - started
+        release_callback(callback_token)
+
+def stats() -> dict[str, Any]:
+    return dict(pending_callbacks=len(_callbacks), **_stats)
+
+async def job_callback(token: str, job: Dict[str, Any]):
+    """Receives the final state of a job submitted with a callback URL
+    (served as 'POST /_callbacks/jobs/{token}')"""
+    fut = _callbacks.get(token)
+    if fut is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="unknown or expired callback")
+    if not _is_finished(job):
+        return {"status": "ignored"}
+    if not fut.done():
+        fut.set_result(job)
+    return {"status": "ok"}
+
+### INTERNAL
+
+_request_deadline: ContextVar[Optional[float]] = ContextVar("job_request_deadline", default=None)
+_callbacks: dict[str, asyncio.Future] = {}
+_stats = {"active": 0, "polls": 0, "callbacks": 0, "timeouts": 0, "wait_seconds": 0.0}
+
+async def _poll(url: str, tool_name: str, location: str) -> tuple[Optional[dict], Optional[float]]:
+    """Returns the job if it has finished, as well as the server's retry hint"""
+    _stats["polls"] += 1
+    headers = { "Timeout": str(JOB_POLL_TIMEOUT) }
+    logger.info(f"Fetching result for tool {tool_name} - {location}")
+    response = await http_client.get(url, timeout=2 * JOB_POLL_TIMEOUT, headers=headers)
+    response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+    if response.status_code != 200:
+        return None, retry_after(response)
+    job = response.json()
+    logger.debug(f"... result {response.status_code} - {job}")
+    if _is_finished(job):
+        return job, None
+    return None, retry_after(response)
+
+def _is_finished(job: dict) -> bool:
+    return job.get("status") == "succeeded" or job.get("status") in FAILED_STATES
+
+def _job_result(job: dict, tool_name: str, location: str) -> Any:
+    state = job.get("status")
+    if state in FAILED_STATES:
+        raise JobWaitError(f"job for tool '{tool_name}' {state} - {job.get('error-message', location)}")
+    return job.get("result-content")
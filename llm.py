@@ -0,0 +1,186 @@
+#
+# Process-wide LLM clients.
+#
+# There is one client per (model, base URL), each backed by a bounded,
+# keep-alive connection pool. The number of concurrent requests per model
+# is limited, so a burst of jobs queues here instead of opening hundreds of
+# parallel connections to the LiteLLM proxy.
+#
+# If enabled, chat responses are served from 'llm_cache' before a request
+# even queues for its model.
+#
+import asyncio
+import os
+import logging
+import time
+from typing import Any, AsyncGenerator, Optional, Sequence
+
+import httpx
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, CompletionResponse
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.llms.openai import OpenAI
+
+import llm_cache
+import streaming
+import timings
+
+logger = logging.getLogger("llm")
+
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 64))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", 32))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 120))
+# max. number of concurrent LLM requests per model
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+# per model overrides, e.g. LLM_MODEL_CONCURRENCY="gpt-4=4,gpt-3.5-turbo=32"
+model_concurrency: dict[str, int] = {
+    k.strip(): int(v) for k, v in
+    (e.split("=", 1) for e in os.environ.get("LLM_MODEL_CONCURRENCY", "").split(",") if "=" in e)
+}
+
+class ModelLimiter:
+    """Limits the number of concurrent requests to a single model"""
+
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+        return self
+
+    async def __aexit__(self, *args):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    def count_tokens(self, usage: dict[str, Any]):
+        """Add the token counts reported with a response"""
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+
+class PooledOpenAI(OpenAI):
+    """An OpenAI LLM which queues async requests beyond its model's concurrency limit"""
+
+    _limiter: ModelLimiter = PrivateAttr()
+
+    def __init__(self, limiter: ModelLimiter, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._limiter = limiter
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await streaming.wait_for_consumer()
+        return await super().achat(messages, **kwargs)
+
+    async def _achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        # below the instrumented 'achat', so cached responses still produce LLM events
+        cache = llm_cache.cache
+        key = None
+        if cache is not None:
+            key = llm_cache.chat_key(messages, self._get_model_kwargs(**kwargs))
+            if not llm_cache.bypassed():
+                response = cache.get(key)
+                if response is not None:
+                    return response
+        queued = time.perf_counter()
+        async with self._limiter:
+            timings.record("llm_queue", time.perf_counter() - queued, self.model)
+            with timings.phase("llm", self.model):
+                response = await super()._achat(messages, **kwargs)
+        self._limiter.count_tokens(response.additional_kwargs)
+        if key is not None:
+            cache.put(key, response)
+        return response
+
+    async def _acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        queued = time.perf_counter()
+        async with self._limiter:
+            timings.record("llm_queue", time.perf_counter() - queued, self.model)
+            with timings.phase("llm", self.model):
+                response = await super()._acomplete(prompt, **kwargs)
+        self._limiter.count_tokens(response.additional_kwargs)
+        return response
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> AsyncGenerator[ChatResponse, None]:
+        await streaming.wait_for_consumer()
+        limiter = self._limiter
+        await limiter.__aenter__()
+        try:
+            gen = await super().astream_chat(messages, **kwargs)
+        except BaseException:
+            await limiter.__aexit__()
+            raise
+
+        async def limited() -> AsyncGenerator[ChatResponse, None]:
+            try:
+                async for r in gen:
+                    yield r
+            finally:
+                await limiter.__aexit__()
+        return limited()
+
+def get_llm(model: str) -> OpenAI:
+    """Returns the shared LLM client for 'model'"""
+    base_url = os.getenv("LITELLM_PROXY")
+    key = (model, base_url)
+    llm = _llms.get(key)
+    if llm is None:
+        llm = _llms[key] = _create_llm(model, base_url)
+    return llm
+
+async def close():
+    """Called on app shutdown to release all pooled connections"""
+    clients = list(_http_clients)
+    _http_clients.clear()
+    _llms.clear()
+    await asyncio.gather(*[c.aclose() for c in clients], return_exceptions=True)
+
+def stats() -> dict[str, Any]:
+    return {
+        "clients": len(_llms),
+        "models": {m: l.stats() for m, l in _limiters.items()},
+    }
+
+### INTERNAL
+
+_llms: dict[tuple[str, Optional[str]], OpenAI] = {}
+_limiters: dict[str, ModelLimiter] = {}
+_http_clients: list[httpx.AsyncClient] = []
+
+def _create_llm(model: str, base_url: Optional[str]) -> OpenAI:
+    limiter = _limiters.get(model)
+    if limiter is None:
+        limiter = _limiters[model] = ModelLimiter(model, model_concurrency.get(model, LLM_MAX_CONCURRENCY))
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    aclient = httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+    _http_clients.append(aclient)
+    kwargs = dict(model=model, reuse_client=True, async_http_client=aclient, timeout=LLM_TIMEOUT)
+    if base_url is not None:
+        kwargs.update(api_base=f"{base_url}/v1", api_key="not-needed")
+    logger.info(f"Creating shared LLM client for '{model}' (proxy: {base_url}, concurrency: {limiter.limit})")
+    return PooledOpenAI(limiter, **kwargs)
@@ -0,0 +1,180 @@
+#
+# Exact-match cache for LLM chat responses (opt-in).
+#
+# Requests are keyed by the normalized message list and all generation
+# parameters (model, temperature, max_tokens, ...), so only a request which
+# would be sent to the LLM unchanged is answered from the cache. Entries are
+# kept in an in-memory LRU and, if LLM_CACHE_DIR is set, also on disk so they
+# survive restarts and can be shared by runners on the same host.
+#
+from collections import OrderedDict
+from contextvars import ContextVar
+import hashlib
+import json
+import os
+import logging
+import time
+from typing import Any, Optional, Sequence
+
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse
+from openai.types.chat import ChatCompletionMessageToolCall
+
+logger = logging.getLogger("llm-cache")
+
+LLM_CACHE_MAX_SIZE = int(os.environ.get("LLM_CACHE_MAX_SIZE", 1024))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 3600))
+
+class LLMCache:
+    """Two tier (memory and optional disk) LRU cache of chat responses"""
+
+    def __init__(self, max_size: int = LLM_CACHE_MAX_SIZE, ttl: float = LLM_CACHE_TTL, directory: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._entries: OrderedDict[str, tuple[float, ChatResponse]] = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: str) -> Optional[ChatResponse]:
+        e = self._entries.get(key)
+        if e is not None:
+            stored_at, response = e
+            if time.time() - stored_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return response.model_copy()
+            del self._entries[key]
+            self.expired += 1
+        if self.directory:
+            rec = self._load(key)
+            if rec is not None:
+                stored_at, response = rec
+                self._remember(key, stored_at, response)
+                self.disk_hits += 1
+                return response.model_copy()
+        self.misses += 1
+        return None
+
+    def put(self, key: str, response: ChatResponse):
+        # the raw (OpenAI) response is neither needed nor serializable
+        response = response.model_copy(update={"raw": None})
+        now = time.time()
+        self._remember(key, now, response)
+        if self.directory:
+            self._save(key, now, response)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "disk": self.directory is not None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups > 0 else 0,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+    def _remember(self, key: str, stored_at: float, response: ChatResponse):
+        self._entries[key] = (stored_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[tuple[float, ChatResponse]]:
+        path = self._path(key)
+        try:
+            with open(path, 'r') as file:
+                rec = json.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"cannot read cached LLM response '{path}' - {e}")
+            return None
+        stored_at = rec.get("stored_at", 0)
+        if time.time() - stored_at > self.ttl:
+            self.expired += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return stored_at, _from_json(rec["response"])
+
+    def _save(self, key: str, stored_at: float, response: ChatResponse):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            rec = {"stored_at": stored_at, "response": response.model_dump(mode="json", exclude={"raw"})}
+            with open(tmp, 'w') as file:
+                json.dump(rec, file, separators=(",", ":"))
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"cannot save LLM response to '{path}' - {e}")
+
+def chat_key(messages: Sequence[ChatMessage], params: dict[str, Any]) -> str:
+    """Returns the cache key for sending 'messages' with generation 'params'"""
+    msgs = [(m.role.value, m.content, m.additional_kwargs) for m in messages]
+    s = json.dumps([msgs, params], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(s.encode()).hexdigest()
+
+def bypassed() -> bool:
+    """Returns true if the current request (context) must not be answered from the
+    cache. A bypassed request still updates the cache with its fresh responses."""
+    if _bypass.get():
+        if cache is not None:
+            cache.bypassed += 1
+        return True
+    return False
+
+def set_bypass(bypass: bool):
+    """Don't answer LLM requests of the current request (context) from the cache"""
+    return _bypass.set(bypass)
+
+def reset_bypass(token):
+    _bypass.reset(token)
+
+def start(enabled: bool, directory: Optional[str] = None):
+    """Called on app startup to enable the cache"""
+    global cache
+    if enabled:
+        cache = LLMCache(directory=directory)
+        logger.info(f"Caching LLM responses (disk: {directory})")
+
+def stats() -> Optional[dict[str, Any]]:
+    return cache.stats() if cache is not None else None
+
+cache: Optional[LLMCache] = None
+
+### INTERNAL
+
+_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+def _from_json(d: dict[str, Any]) -> ChatResponse:
+    # tool calls are kept as OpenAI objects in 'additional_kwargs', which don't
+    # survive the JSON round trip, but are required by 'get_tool_calls_from_response'
+    response = ChatResponse.model_validate(d)
+    kwargs = response.message.additional_kwargs
+    if kwargs.get("tool_calls"):
+        kwargs["tool_calls"] = [
+            ChatCompletionMessageToolCall.model_validate(tc) if isinstance(tc, dict) else tc
+            for tc in kwargs["tool_calls"]
+        ]
+    return response
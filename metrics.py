@@ -0,0 +1,198 @@
+#
+# Metrics in the Prometheus text format, served by 'GET /metrics'.
+#
+# Apart from the number of agent runs, all values are collected from the
+# 'stats()' of the runner's modules (and the histograms of 'timings') when
+# scraped. The hot path therefore only ever increments plain counters, which
+# are all updated on the event loop and need no locking.
+#
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+import coalescing
+import events
+import executors
+import http_client
+import job_wait
+import llm
+import llm_cache
+import scheduler
+import sessions
+import timings
+import tool_memo
+from tool import tool_cache
+
+METRICS_PREFIX = "llama_agent_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = dict[str, str]
+
+class MetricsWriter:
+    """Collects metric families and formats them in the Prometheus text format"""
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self.lines: list[str] = []
+
+    def gauge(self, name: str, help: str, samples: Iterable[tuple[Labels, Any]]):
+        self._family(name, "gauge", help, samples)
+
+    def counter(self, name: str, help: str, samples: Iterable[tuple[Labels, Any]]):
+        self._family(name + "_total", "counter", help, samples)
+
+    def histogram(self, name: str, help: str, samples: Iterable[tuple[Labels, timings.Histogram]]):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, h in samples:
+            for le, n in h.cumulative():
+                bound = "+Inf" if le == float("inf") else repr(float(le))
+                self.lines.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {n}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {_value(h.sum)}")
+            self.lines.append(f"{name}_count{_labels(labels)} {h.count}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+    def _family(self, name: str, kind: str, help: str, samples: Iterable[tuple[Labels, Any]]):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is not None:
+                self.lines.append(f"{name}{_labels(labels)} {_value(value)}")
+
+@contextmanager
+def agent_run() -> Iterator[None]:
+    """Count an agent run for the duration of the 'with' block"""
+    _runs["in_flight"] += 1
+    try:
+        yield
+        _runs["succeeded"] += 1
+    except BaseException:
+        _runs["failed"] += 1
+        raise
+    finally:
+        _runs["in_flight"] -= 1
+
+def render(agent_pool_stats: dict[str, Any]) -> str:
+    """Returns the current metrics of the runner"""
+    w = MetricsWriter()
+    w.gauge("agent_runs_in_flight", "Agent runs currently executing", [({}, _runs["in_flight"])])
+    w.counter("agent_runs", "Finished agent runs", [
+        ({"outcome": "succeeded"}, _runs["succeeded"]),
+        ({"outcome": "failed"}, _runs["failed"]),
+    ])
+
+    sched = scheduler.stats()
+    if sched is not None:
+        w.gauge("agent_runs_running", "Agent runs admitted by the scheduler", [({}, sched["running"])])
+        w.gauge("agent_runs_queued", "Agent runs waiting to be admitted", [({"priority": p}, n) for p, n in sched["waiting"].items()])
+        w.gauge("agent_concurrency_limit", "Max. number of agent runs executed at the same time", [({}, sched["max_concurrency"])])
+        w.gauge("agent_queue_limit", "Max. number of queued agent runs", [({}, sched["queue_size"])])
+        w.counter("agent_runs_rejected", "Agent runs rejected (including displaced and timed out ones)", [({}, sched["rejected"])])
+        w.counter("agent_runs_displaced", "Queued agent runs displaced by runs of higher priority", [({}, sched["displaced"])])
+        w.counter("agent_queue_timeouts", "Agent runs which waited too long to be admitted", [({}, sched["timeouts"])])
+    w.histogram("agent_queue_duration_seconds", "Time agent runs waited to be admitted", _histograms("queue", "priority"))
+    w.histogram("agent_run_duration_seconds", "Duration of admitted agent runs", _histograms("run", "priority"))
+    co = coalescing.stats()
+    w.gauge("coalesced_runs_in_flight", "Shareable agent runs currently executing", [({}, co["in_flight"])])
+    w.counter("coalesced_requests", "Requests which joined an identical run in flight instead of executing", [({}, co["joined"])])
+
+    models = llm.stats()["models"]
+    w.gauge("llm_requests_in_flight", "LLM requests currently executing", _per(models, "model", "in_flight"))
+    w.gauge("llm_requests_waiting", "LLM requests queued for a free slot of their model", _per(models, "model", "waiting"))
+    w.gauge("llm_concurrency_limit", "Max. number of concurrent LLM requests", _per(models, "model", "limit"))
+    w.counter("llm_requests", "LLM requests sent", _per(models, "model", "requests"))
+    w.counter("llm_tokens", "Tokens used by LLM requests", [
+        *(({"model": m, "type": "prompt"}, s["prompt_tokens"]) for m, s in models.items()),
+        *(({"model": m, "type": "completion"}, s["completion_tokens"]) for m, s in models.items()),
+    ])
+    w.histogram("llm_request_duration_seconds", "Duration of LLM requests", _histograms("llm", "model"))
+    w.counter("llm_request_errors", "Failed LLM requests", _errors("llm", "model"))
+    w.histogram("llm_queue_duration_seconds", "Time LLM requests waited for a free slot of their model", _histograms("llm_queue", "model"))
+    cache = llm_cache.stats()
+    if cache is not None:
+        w.counter("llm_cache_hits", "LLM requests answered from the cache", [
+            ({"tier": "memory"}, cache["memory_hits"]),
+            ({"tier": "disk"}, cache["disk_hits"]),
+        ])
+        w.counter("llm_cache_misses", "LLM requests not found in the cache", [({}, cache["misses"])])
+
+    w.histogram("tool_call_duration_seconds", "Duration of tool calls (not answered from the memo) per tool URN", _histograms("tool", "tool"))
+    w.counter("tool_call_errors", "Failed tool calls per tool URN", _errors("tool", "tool"))
+    w.histogram("tool_job_wait_seconds", "Time spent waiting for accepted tool jobs per tool URN", _histograms("job_wait", "tool"))
+    memo = tool_memo.stats()
+    w.counter("tool_memo_hits", "Tool calls answered from the memo", [({}, memo["hits"])])
+    w.counter("tool_memo_misses", "Memoizable tool calls not found in the memo", [({}, memo["misses"])])
+
+    tc = tool_cache.stats()
+    w.gauge("tool_cache_size", "Resolved tool definitions in the cache", [({}, tc["size"])])
+    w.counter("tool_cache_hits", "Tool resolutions answered from the cache", [({}, tc["hits"] + tc["negative_hits"])])
+    w.counter("tool_cache_misses", "Tool resolutions not found in the cache", [({}, tc["misses"])])
+    w.gauge("tool_cache_hit_ratio", "Share of tool resolutions answered from the cache", [({}, tc["hit_rate"])])
+    ap = agent_pool_stats
+    w.gauge("agent_pool_in_use", "Agents currently executing a request", [({}, ap["in_use"])])
+    w.gauge("agent_pool_idle", "Idle agents in the pool", [({}, ap["idle"])])
+    w.counter("agent_pool_hits", "Requests served by a pooled agent", [({}, ap["hits"])])
+    w.counter("agent_pool_misses", "Requests which needed a new agent", [({}, ap["misses"])])
+    w.gauge("agent_pool_hit_ratio", "Share of requests served by a pooled agent", [({}, ap["hit_rate"])])
+
+    jw = job_wait.stats()
+    w.gauge("job_waits_active", "Accepted tool jobs currently waited for", [({}, jw["active"])])
+    w.gauge("job_callbacks_pending", "Accepted tool jobs waiting for a callback", [({}, jw["pending_callbacks"])])
+    w.counter("job_polls", "Polls of accepted tool jobs", [({}, jw["polls"])])
+    w.counter("job_callbacks", "Accepted tool jobs finished by a callback", [({}, jw["callbacks"])])
+    w.counter("job_timeouts", "Accepted tool jobs given up on", [({}, jw["timeouts"])])
+    w.counter("job_wait_seconds", "Time spent waiting for accepted tool jobs", [({}, jw["wait_seconds"])])
+
+    hosts = http_client.stats()["hosts"]
+    w.gauge("http_requests_in_flight", "Requests to tool services currently executing", _per(hosts, "host", "in_flight"))
+    w.gauge("http_requests_waiting", "Requests to tool services waiting for a connection", _per(hosts, "host", "waiting"))
+    w.gauge("http_connections", "Open connections to tool services", _per(hosts, "host", "connections"))
+    w.counter("http_request_errors", "Failed requests to tool services", _per(hosts, "host", "errors"))
+
+    ex = executors.stats()
+    w.gauge("executor_tasks_active", "Builtin tool calls executing or waiting in a pool", _per(ex, "pool", "active"))
+    w.gauge("executor_workers", "Size of the pools for builtin tools", _per(ex, "pool", "workers"))
+
+    ev = events.stats()
+    w.gauge("event_handlers", "Registered event handlers", [({}, ev["handlers"])])
+    w.gauge("event_spans", "Open spans of all event handlers", [({}, ev["spans"])])
+    w.gauge("event_span_bytes", "Approximate memory used by open spans", [({}, ev["span_bytes"])])
+
+    ss = sessions.stats()
+    w.gauge("sessions", "Chat sessions kept", [({"store": ss["store"]}, ss["sessions"])])
+
+    return w.text()
+
+def stats() -> dict[str, Any]:
+    return dict(_runs)
+
+### INTERNAL
+
+_runs = {"in_flight": 0, "succeeded": 0, "failed": 0}
+
+def _per(stats: dict[str, dict[str, Any]], label: str, field: str) -> list[tuple[Labels, Any]]:
+    return [({label: key}, s.get(field)) for key, s in stats.items()]
+
+def _histograms(phase: str, label: str) -> list[tuple[Labels, timings.Histogram]]:
+    return [({label: l}, h) for (p, l), h in list(timings.histograms.items()) if p == phase]
+
+def _errors(phase: str, label: str) -> list[tuple[Labels, int]]:
+    return [({label: l}, timings.errors.get((p, l), 0)) for (p, l) in list(timings.histograms) if p == phase]
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _value(v: Any) -> str:
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
@@ -0,0 +1,124 @@
+#
+# Agents executing independent tool calls concurrently.
+#
+# A ReAct agent only ever requests a single tool call per step. With
+# 'parallel_tools', a function calling agent is used instead, which may
+# request several tool calls at once. These are executed concurrently, at
+# most MAX_PARALLEL_TOOLS (or the request's 'max_parallel_tools') at a time.
+# Their results are added to the agent's memory, and their events reported,
+# in the order the LLM requested them, so runs stay reproducible.
+#
+import asyncio
+from contextvars import ContextVar
+import os
+from typing import Any, List, Optional, Sequence
+
+from llama_index.core.agent import AgentRunner, FunctionCallingAgentWorker
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.llms.llm import ToolSelection
+from llama_index.core.memory import BaseMemory
+from llama_index.core.tools import BaseTool, ToolOutput
+from llama_index.llms.openai import OpenAI
+
+from events import dispatch_event, has_subscriber, register_event_handler, unregister_event_handler
+
+MAX_PARALLEL_TOOLS = int(os.environ.get("MAX_PARALLEL_TOOLS", 4))
+
+def create_agent(tools: List[BaseTool], llm: OpenAI) -> AgentRunner:
+    """Returns an agent executing multiple tool calls of a step concurrently"""
+    worker = OrderedParallelWorker.from_tools(tools, llm=llm, allow_parallel_tool_calls=True, verbose=False)
+    return AgentRunner(worker)
+
+def set_max_parallel_tools(limit: Optional[int]):
+    """Limit the number of concurrent tool calls per step in the current request (context)"""
+    return _max_parallel.set(limit or MAX_PARALLEL_TOOLS)
+
+def reset_max_parallel_tools(token):
+    _max_parallel.reset(token)
+
+class OrderedParallelWorker(FunctionCallingAgentWorker):
+    """Function calling agent worker which executes the tool calls of a step
+    concurrently, but commits their results in the order they were requested"""
+
+    async def _acall_function(
+        self,
+        tools: Sequence[BaseTool],
+        tool_call: ToolSelection,
+        memory: BaseMemory,
+        sources: List[ToolOutput],
+        verbose: bool = False,
+    ) -> bool:
+        # All calls of a step are started (by 'asyncio.gather') in the order
+        # requested, so taking a ticket before the first 'await' numbers them.
+        seq = _sequencer(memory)
+        ticket = seq.take()
+        messages = _MessageBuffer()
+        outputs: List[ToolOutput] = []
+        records: List[Any] = []
+        # this call runs in its own task (context), so this only captures its events
+        subscription = register_event_handler(records.append) if has_subscriber() else None
+        try:
+            async with seq.slots:
+                return await super()._acall_function(tools, tool_call, messages, outputs, verbose)
+        finally:
+            if subscription is not None:
+                unregister_event_handler(subscription)
+            try:
+                await seq.wait_turn(ticket)
+                for m in messages.messages:
+                    memory.put(m)
+                sources.extend(outputs)
+                for r in records:
+                    dispatch_event(r)
+            finally:
+                seq.done(ticket, memory)
+
+### INTERNAL
+
+_max_parallel: ContextVar[int] = ContextVar("max_parallel_tools", default=MAX_PARALLEL_TOOLS)
+
+class _MessageBuffer:
+    """Collects what a single tool call adds to the agent's memory"""
+    __slots__ = ("messages",)
+
+    def __init__(self):
+        self.messages: List[ChatMessage] = []
+
+    def put(self, message: ChatMessage):
+        self.messages.append(message)
+
+class _Sequencer:
+    """Orders the tool calls of a step and limits their concurrency"""
+
+    def __init__(self, limit: int):
+        self.slots = asyncio.Semaphore(limit)
+        self.issued = 0
+        self.committed = 0
+        self._waiting: dict[int, asyncio.Future] = {}
+
+    def take(self) -> int:
+        ticket = self.issued
+        self.issued += 1
+        return ticket
+
+    async def wait_turn(self, ticket: int):
+        if self.committed < ticket:
+            fut = self._waiting[ticket] = asyncio.get_running_loop().create_future()
+            await fut
+
+    def done(self, ticket: int, memory: BaseMemory):
+        self.committed += 1
+        fut = self._waiting.pop(self.committed, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+        if self.committed == self.issued:
+            _sequencers.pop(id(memory), None) # all calls of the step are done
+
+# one sequencer per agent memory with outstanding tool calls
+_sequencers: dict[int, _Sequencer] = {}
+
+def _sequencer(memory: BaseMemory) -> _Sequencer:
+    seq = _sequencers.get(id(memory))
+    if seq is None:
+        seq = _sequencers[id(memory)] = _Sequencer(_max_parallel.get())
+    return seq
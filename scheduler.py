@@ -0,0 +1,238 @@
+#
+# Admission control for agent runs.
+#
+# At most AGENT_MAX_CONCURRENCY runs execute at the same time. Further runs
+# wait in a queue of at most AGENT_QUEUE_SIZE entries, served by priority
+# class first and arrival second. When the queue is full, a new run displaces
+# the latest waiter of a lower class, or is otherwise rejected right away
+# (429). Runs which are unlikely to start within AGENT_QUEUE_TIMEOUT are
+# rejected as well (503), and so are queued runs which were displaced or
+# waited that long. Rejections carry a 'Retry-After' estimated from the
+# duration of recent runs. Blocking runs (e.g. of batch mode) are exempt from
+# all of this, they simply wait in the queue until it's their turn.
+#
+# Under overload the runner therefore keeps executing a bounded number of
+# runs at full speed instead of slowing all of them down until they time out.
+#
+import asyncio
+from contextlib import asynccontextmanager
+import heapq
+import itertools
+import math
+import os
+import logging
+import time
+from typing import Any, AsyncIterator, Optional
+
+import timings
+from utils import StrEnum
+
+logger = logging.getLogger("scheduler")
+
+AGENT_MAX_CONCURRENCY = int(os.environ.get("AGENT_MAX_CONCURRENCY", 32))
+AGENT_QUEUE_SIZE = int(os.environ.get("AGENT_QUEUE_SIZE", 128))
+AGENT_QUEUE_TIMEOUT = float(os.environ.get("AGENT_QUEUE_TIMEOUT", 300))
+# assumed duration of a run until the first ones finished
+INITIAL_RUN_ESTIMATE = 10
+MAX_RETRY_AFTER = 300
+
+class PriorityE(StrEnum):
+    Interactive = "interactive"
+    Batch = "batch"
+
+class Rejected(Exception):
+    """A run was not admitted"""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class Ticket:
+    """A run's claim on the scheduler: either a slot, or a place in the queue"""
+    __slots__ = ("priority", "blocking", "created", "fut", "queued", "claimed", "cancelled", "rejection")
+
+    def __init__(self, priority: PriorityE, blocking: bool = False):
+        self.priority = priority
+        self.blocking = blocking
+        self.created = time.perf_counter()
+        self.fut: Optional[asyncio.Future] = None # None if granted a slot right away, done once decided
+        self.queued = False
+        self.claimed = False
+        self.cancelled = False
+        self.rejection: Optional[Rejected] = None # set if rejected after being queued
+
+class Scheduler:
+    """Limits the number of concurrent runs and queues the excess by priority"""
+
+    def __init__(self, max_concurrency: int, queue_size: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = {p: 0 for p in PriorityE}
+        self._queue: list[tuple[int, int, Ticket]] = []
+        self._seq = itertools.count()
+        self._run_estimate: Optional[float] = None # moving average of run durations
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.displaced = 0
+        self.timeouts = 0
+
+    def admit(self, priority: PriorityE, block: bool = False) -> Ticket:
+        """Take a slot, or a place in the queue, for a run of 'priority'. Raises
+        'Rejected' if there is neither. This doesn't wait, so requests can be
+        rejected before doing any work. The ticket is later passed to 'slot'.
+
+        A 'block'ing run is always queued, and is neither displaced nor timed out."""
+        t = Ticket(priority, block)
+        if self.running < self.max_concurrency and self._queue_length() == 0:
+            self.running += 1
+            self.admitted += 1
+            return t
+        rank = _RANK[priority]
+        victim = None
+        if not block:
+            if self._queue_length() >= self.queue_size:
+                victim = self._displaceable(rank)
+                if victim is None:
+                    raise self._rejection(429, "too many queued requests")
+            elif self.expected_wait() > self.queue_timeout:
+                raise self._rejection(503, "request would not start in time")
+        if victim is not None:
+            self._remove(victim)
+            self.displaced += 1
+            victim.rejection = self._rejection(503, "displaced by a request of higher priority")
+            victim.fut.set_result(None)
+        t.fut = asyncio.get_running_loop().create_future()
+        t.queued = True
+        heapq.heappush(self._queue, (rank, next(self._seq), t))
+        self.waiting[priority] += 1
+        self.queued += 1
+        return t
+
+    def cancel(self, t: Ticket):
+        """Give up a ticket which was not (and will not be) passed to 'slot'"""
+        if t.claimed or t.cancelled:
+            return
+        t.cancelled = True
+        if t.queued:
+            self._remove(t)
+        elif _granted(t):
+            self._release()
+
+    def cancel_later(self, t: Ticket, delay: float):
+        """Give up 't' unless passed to 'slot' within 'delay' seconds"""
+        asyncio.get_running_loop().call_later(delay, self.cancel, t)
+
+    @asynccontextmanager
+    async def slot(self, priority: PriorityE, ticket: Optional[Ticket] = None, block: bool = False) -> AsyncIterator[None]:
+        """Execute the 'with' block once admitted, using 'ticket' if it's still
+        valid. Raises 'Rejected' if not admitted, unless the run should 'block'
+        until admitted (see 'admit')."""
+        if ticket is None or ticket.claimed or ticket.cancelled:
+            ticket = self.admit(priority, block)
+        ticket.claimed = True
+        await self._wait(ticket)
+        started = time.perf_counter()
+        timings.record("queue", started - ticket.created, priority.value)
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            timings.record("run", duration, priority.value)
+            est = self._run_estimate
+            self._run_estimate = duration if est is None else 0.8 * est + 0.2 * duration
+            self._release()
+
+    def expected_wait(self) -> float:
+        """Returns the estimated time (in seconds) a new run would have to wait"""
+        if self.running < self.max_concurrency:
+            return 0
+        est = self._run_estimate if self._run_estimate is not None else INITIAL_RUN_ESTIMATE
+        return est * (self._queue_length() + 1) / self.max_concurrency
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_size": self.queue_size,
+            "running": self.running,
+            "waiting": {p.value: n for p, n in self.waiting.items()},
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "displaced": self.displaced,
+            "timeouts": self.timeouts,
+            "run_estimate": self._run_estimate,
+        }
+
+    async def _wait(self, t: Ticket):
+        if t.fut is None:
+            return # granted right away
+        timeout = None if t.blocking else max(0, t.created + self.queue_timeout - time.perf_counter())
+        try:
+            await asyncio.wait_for(t.fut, timeout)
+        except asyncio.TimeoutError:
+            self._remove(t)
+            self.timeouts += 1
+            t.rejection = self._rejection(503, f"not started within {self.queue_timeout}s")
+            raise t.rejection
+        except asyncio.CancelledError:
+            if t.queued:
+                self._remove(t)
+            elif _granted(t):
+                self._release() # was handed a slot, but is no longer interested
+            raise
+        if t.rejection is not None:
+            raise t.rejection # displaced
+        self.admitted += 1
+
+    def _release(self):
+        while self._queue:
+            _, _, t = heapq.heappop(self._queue)
+            if t.queued:
+                self._remove(t)
+                t.fut.set_result(None) # hand the slot over
+                return
+        self.running -= 1
+
+    def _remove(self, t: Ticket):
+        # the entry stays in the heap until popped, but no longer counts
+        if t.queued:
+            t.queued = False
+            self.waiting[t.priority] -= 1
+
+    def _queue_length(self) -> int:
+        return sum(self.waiting.values())
+
+    def _displaceable(self, rank: int) -> Optional[Ticket]:
+        # the latest (non blocking) waiter of the lowest class, if that's lower than 'rank'
+        victim = max(((r, seq, t) for r, seq, t in self._queue if t.queued and not t.blocking), default=None, key=lambda e: e[:2])
+        if victim is None or victim[0] <= rank:
+            return None
+        return victim[2]
+
+    def _rejection(self, status_code: int, message: str) -> Rejected:
+        self.rejected += 1
+        retry_after = min(MAX_RETRY_AFTER, max(1, math.ceil(self.expected_wait())))
+        return Rejected(status_code, message, retry_after)
+
+def start(max_concurrency: int = AGENT_MAX_CONCURRENCY, queue_size: int = AGENT_QUEUE_SIZE, queue_timeout: float = AGENT_QUEUE_TIMEOUT):
+    """Called on app startup"""
+    global scheduler
+    scheduler = Scheduler(max_concurrency, queue_size, queue_timeout)
+    logger.info(f"Executing at most {max_concurrency} agent runs at a time, queueing up to {queue_size}")
+
+def stats() -> Optional[dict[str, Any]]:
+    return scheduler.stats() if scheduler is not None else None
+
+scheduler: Optional[Scheduler] = None
+
+### INTERNAL
+
+_RANK = {PriorityE.Interactive: 0, PriorityE.Batch: 1}
+
+def _granted(t: Ticket) -> bool:
+    # a slot, either right away or handed over from a finished run
+    return t.fut is None or (t.fut.done() and not t.fut.cancelled() and t.rejection is None)
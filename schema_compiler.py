@@ -0,0 +1,194 @@
+#
+# Compiles the JSON schema of a tool's arguments ('fn_schema') into a pydantic
+# model plus a ready-to-use validator.
+#
+# Compiled schemas are cached by a canonical hash of the schema document, so
+# the many tools sharing an identical 'fn_schema' only pay for compilation once.
+#
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import logging
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, create_model
+
+logger = logging.getLogger("schema-compiler")
+
+SCHEMA_CACHE_MAX_SIZE = int(os.environ.get("SCHEMA_CACHE_MAX_SIZE", 512))
+
+class CompiledSchema:
+    """A pydantic model created from a JSON schema together with its validator"""
+    __slots__ = ("key", "model", "adapter")
+
+    def __init__(self, key: str, model: type[BaseModel]):
+        self.key = key
+        self.model = model
+        self.adapter = TypeAdapter(model)
+
+    def validate(self, args: Dict[str, Any]) -> BaseModel:
+        return self.adapter.validate_python(args)
+
+def schema_key(schema: dict) -> str:
+    """Returns a canonical hash of 'schema'. The top-level title is ignored as
+    it only carries the tool name and isn't part of the argument description."""
+    if "title" in schema:
+        schema = {k: v for k, v in schema.items() if k != "title"}
+    doc = json.dumps(schema, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(doc.encode("utf-8")).hexdigest()
+
+def compile_schema(schema: dict, model_name: str) -> CompiledSchema:
+    key = schema_key(schema)
+    cs = _cache.get(key)
+    if cs is not None:
+        _cache.move_to_end(key)
+        _stats["hits"] += 1
+        return cs
+
+    _stats["misses"] += 1
+    model = _SchemaCompiler(schema).compile_model(schema, model_name)
+    cs = CompiledSchema(key, model)
+    _cache[key] = cs
+    while len(_cache) > SCHEMA_CACHE_MAX_SIZE:
+        _cache.popitem(last=False)
+        _stats["evictions"] += 1
+    return cs
+
+def stats() -> dict[str, Any]:
+    return dict(size=len(_cache), max_size=SCHEMA_CACHE_MAX_SIZE, **_stats)
+
+### INTERNAL
+
+_cache: OrderedDict[str, CompiledSchema] = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_SIMPLE_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+    "null": type(None),
+}
+
+class _SchemaCompiler:
+    """Maps a single JSON schema document (and its '$defs') to python types"""
+
+    def __init__(self, root: dict):
+        self.root = root
+        self.refs: dict[str, Any] = {}
+        self.in_progress: set[str] = set()
+
+    def compile_model(self, schema: dict, model_name: str) -> type[BaseModel]:
+        fields = {}
+        required = schema.get("required", [])
+        for field_name, field_schema in schema.get("properties", {}).items():
+            python_type = self.to_type(field_schema, model_name + "_" + field_name.capitalize())
+            is_required = field_name in required
+
+            # Handle optional fields
+            if not is_required:
+                python_type = Optional[python_type]
+
+            #Create Field with extra information
+            field_kwargs = {}
+            if "default" in field_schema:
+                field_kwargs["default"] = field_schema["default"]
+            elif not is_required:
+                field_kwargs["default"] = None
+            if "description" in field_schema:
+                field_kwargs["description"] = field_schema["description"]
+            if "minimum" in field_schema:
+                field_kwargs["ge"] = field_schema["minimum"]
+            if "maximum" in field_schema:
+                field_kwargs["le"] = field_schema["maximum"]
+            if "pattern" in field_schema:
+                field_kwargs["pattern"] = field_schema["pattern"]
+
+            fields[field_name] = (python_type, Field(**field_kwargs))
+
+        additional = schema.get("additionalProperties")
+        config = None
+        if additional is False:
+            config = ConfigDict(extra="forbid")
+        elif additional is not None:
+            config = ConfigDict(extra="allow")
+        return create_model(model_name, __config__=config, **fields)
+
+    def to_type(self, schema: dict, name: str) -> Any:
+        if not isinstance(schema, dict):
+            return Any
+
+        if "$ref" in schema:
+            return self.resolve_ref(schema["$ref"])
+
+        if "enum" in schema:
+            values = tuple(schema["enum"])
+            return Literal[values] if len(values) > 0 else Any
+
+        if "const" in schema:
+            return Literal[schema["const"]]
+
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                return self._union([self.to_type(s, f"{name}{i}") for i, s in enumerate(schema[key])])
+
+        if "allOf" in schema and len(schema["allOf"]) == 1:
+            return self.to_type(schema["allOf"][0], name)
+
+        field_type = schema.get("type")
+        if isinstance(field_type, list):
+            return self._union([self.to_type({**schema, "type": t}, name) for t in field_type])
+
+        if field_type in _SIMPLE_TYPES:
+            return _SIMPLE_TYPES[field_type]
+
+        if field_type == "array":
+            items = schema.get("items")
+            if not items:
+                return List[Any]  # Default to List[Any] if item type is not specified
+            return List[self.to_type(items, name)]
+
+        if field_type == "object" or "properties" in schema:
+            if "properties" in schema:
+                return self.compile_model(schema, name)
+            additional = schema.get("additionalProperties")
+            if isinstance(additional, dict):
+                return Dict[str, self.to_type(additional, name)]
+            return Dict[str, Any]
+
+        return Any  # Default to Any if type is unknown
+
+    def resolve_ref(self, ref: str) -> Any:
+        if ref in self.refs:
+            return self.refs[ref]
+        if ref in self.in_progress:
+            # recursive definitions are not supported, accept any object instead
+            return Dict[str, Any]
+
+        if not ref.startswith("#/"):
+            logger.warning(f"unsupported external schema reference '{ref}'")
+            return Any
+        target: Any = self.root
+        for part in ref[2:].split("/"):
+            part = part.replace("~1", "/").replace("~0", "~")
+            target = target.get(part) if isinstance(target, dict) else None
+        if target is None:
+            logger.warning(f"cannot resolve schema reference '{ref}'")
+            return Any
+
+        self.in_progress.add(ref)
+        try:
+            t = self.to_type(target, target.get("title") or ref.rsplit("/", 1)[-1])
+        finally:
+            self.in_progress.discard(ref)
+        self.refs[ref] = t
+        return t
+
+    def _union(self, types: List[Any]) -> Any:
+        types = list(dict.fromkeys(types)) # remove duplicates, keep order
+        if len(types) == 0:
+            return Any
+        if len(types) == 1:
+            return types[0]
+        return Union[tuple(types)]
@@ -4,8 +4,13 @@ this_dir = os.path.dirname(__file__)
 src_dir = os.path.abspath(os.path.join(this_dir, "../../src"))
 sys.path.insert(0, src_dir)
 
-from typing import ClassVar, List, Optional
-from fastapi import FastAPI
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, ClassVar, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 from pydantic import BaseModel, Field
 import argparse
@@ -15,7 +20,7 @@ from dotenv import load_dotenv
 
 from ivcap_ai_tool.builder import ToolOptions, add_tool_api_route
 from ivcap_ai_tool.server import start_tool_server
-from llama_index.core.agent import ReActAgent
+from llama_index.core.agent import AgentRunner, ReActAgent
 from llama_index.llms.openai import OpenAI
 
 
@@ -30,8 +35,29 @@ load_dotenv()
 logger = getLogger("app")
 
 #from runner import run_query
-from tool import resolve_tool
+from tool import resolve_tools, tool_cache
 from utils import SchemaModel, StrEnum
+import http_client
+import tool_snapshot
+import schema_compiler
+import job_wait
+from agent_pool import AgentPool, pool_key
+import llm
+import llm_cache
+import tool_memo
+import executors
+import streaming
+import events
+import sessions
+import parallel_agent
+import tool_api
+import batch
+import timings
+import metrics
+import scheduler
+from scheduler import PriorityE
+import coalescing
+from events import register_event_handler, unregister_event_handler
 
 # shutdown pod cracefully
 signal(SIGTERM, lambda _1, _2: sys.exit(0))
@@ -42,6 +68,38 @@ description = """
 >>> A lot more usefule information here.
 """
 
+# The IVCAP tool executor runs every job on a new event loop in a worker
+# thread. All the shared pools and caches belong to the app's loop though,
+# so jobs are handed over to it (see 'agent_runner').
+_app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# max. time (in seconds) between admitting a request and its job starting
+ADMISSION_CLAIM_TIMEOUT = 30
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _app_loop
+    _app_loop = asyncio.get_running_loop()
+    http_client.start()
+    snapshot_file = os.getenv("TOOL_SNAPSHOT_FILE")
+    preload = [urn.strip() for urn in os.getenv("PRELOAD_TOOLS", "").split(",") if urn.strip()]
+    await tool_snapshot.start(snapshot_file, preload)
+    sessions.start(os.getenv("SESSION_STORE"))
+    cache_dir = os.getenv("LLM_CACHE_DIR")
+    llm_cache.start(os.getenv("LLM_CACHE", "").lower() in ("1", "true", "yes") or bool(cache_dir), cache_dir)
+    scheduler.start(
+        int(os.getenv("AGENT_MAX_CONCURRENCY", scheduler.AGENT_MAX_CONCURRENCY)),
+        int(os.getenv("AGENT_QUEUE_SIZE", scheduler.AGENT_QUEUE_SIZE)),
+        float(os.getenv("AGENT_QUEUE_TIMEOUT", scheduler.AGENT_QUEUE_TIMEOUT)),
+    )
+    yield
+    sessions.stop()
+    executors.shutdown()
+    await tool_snapshot.stop(snapshot_file)
+    await http_client.close()
+    await llm.close()
+    _app_loop = None
+
 app = FastAPI(
     title=title,
     description=description,
@@ -52,17 +110,81 @@ app = FastAPI(
         "email": "max.ott@data61.csiro.au",
     },
     docs_url="/docs", # ONLY set when there is no default GET
+    lifespan=lifespan,
 )
 
+app.add_api_route("/_callbacks/jobs/{token}", job_wait.job_callback, methods=["POST"], tags=["System"], include_in_schema=False)
+app.add_api_route("/tools/invoke", tool_api.invoke_tool, methods=["POST"], tags=["Tools"], response_model=tool_api.ToolResult, response_model_by_alias=True)
+app.add_api_route("/tools/batch", tool_api.invoke_tools, methods=["POST"], tags=["Tools"], response_model=tool_api.ToolBatchResponse, response_model_by_alias=True)
+
+@app.get("/_stats", tags=["System"])
+async def runner_stats():
+    """Returns the state of the runner's internal pools and caches"""
+    # async, so the state is read on the event loop updating it, not in a worker thread
+    return {
+        "http": http_client.stats(),
+        "tool_cache": tool_cache.stats(),
+        "tool_memo": tool_memo.stats(),
+        "executors": executors.stats(),
+        "schema_cache": schema_compiler.stats(),
+        "job_wait": job_wait.stats(),
+        "agent_pool": agent_pool.stats(),
+        "llm": llm.stats(),
+        "llm_cache": llm_cache.stats(),
+        "events": events.stats(),
+        "sessions": sessions.stats(),
+        "timings": timings.stats(),
+        "runs": metrics.stats(),
+        "scheduler": scheduler.stats(),
+        "coalescing": coalescing.stats(),
+    }
+
+@app.get("/metrics", tags=["System"], response_class=PlainTextResponse)
+async def runner_metrics():
+    """Returns the runner's metrics in the Prometheus text format"""
+    # async, so the state is read on the event loop updating it, not in a worker thread
+    return PlainTextResponse(metrics.render(agent_pool.stats()), media_type=metrics.CONTENT_TYPE)
+
 def service_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
     parser.add_argument('--litellm-proxy', type=str, help='Address of the the LiteLlmProxy')
     parser.add_argument('--dump-builtin-ivcap-definitions', type=str, help='Write an IVCAP toold description for every builtin tool')
     parser.add_argument('--testing', action="store_true", help='Add tools for testing (testing.py)')
+    parser.add_argument('--tool-snapshot', type=str, help='File to persist resolved tool definitions to and restore them from on startup')
+    parser.add_argument('--preload-tools', type=str, help='Comma separated list of tool URNs to resolve before accepting requests')
+    parser.add_argument('--tool-threads', type=int, help='Size of the thread pool for builtin tools')
+    parser.add_argument('--tool-processes', type=int, help='Size of the process pool for CPU bound builtin tools')
+    parser.add_argument('--llm-cache', action="store_true", help='Answer repeated identical LLM requests from a cache')
+    parser.add_argument('--llm-cache-dir', type=str, help='Also keep cached LLM responses in this directory (implies --llm-cache)')
+    parser.add_argument('--session-store', type=str, help="Where to keep chat sessions: 'memory' (default), 'file:<dir>' or 'dbm:<file>'")
+    parser.add_argument('--max-concurrency', type=int, help='Max. number of agent runs executed at the same time, others are queued')
+    parser.add_argument('--queue-size', type=int, help='Max. number of queued agent runs, further requests are rejected')
+    parser.add_argument('--batch', type=str, help='Execute all requests in this JSONL file and exit, instead of starting the server')
+    parser.add_argument('--batch-output', type=str, help="JSONL file to append the results of '--batch' to, also used to resume an interrupted batch (default: '<batch>.results.jsonl')")
+    parser.add_argument('--batch-concurrency', type=int, help="Max. number of requests of '--batch' executed at the same time")
 
     args = parser.parse_args()
 
     if args.litellm_proxy != None:
-        os.setenv("LITELLM_PROXY", args.litellm_proxy)
+        os.environ["LITELLM_PROXY"] = args.litellm_proxy
+
+    if args.tool_snapshot != None:
+        os.environ["TOOL_SNAPSHOT_FILE"] = args.tool_snapshot
+    if args.preload_tools != None:
+        os.environ["PRELOAD_TOOLS"] = args.preload_tools
+    if args.tool_threads != None:
+        os.environ["TOOL_THREAD_WORKERS"] = str(args.tool_threads)
+    if args.tool_processes != None:
+        os.environ["TOOL_PROCESS_WORKERS"] = str(args.tool_processes)
+    if args.llm_cache:
+        os.environ["LLM_CACHE"] = "true"
+    if args.llm_cache_dir != None:
+        os.environ["LLM_CACHE_DIR"] = args.llm_cache_dir
+    if args.session_store != None:
+        os.environ["SESSION_STORE"] = args.session_store
+    if args.max_concurrency != None:
+        os.environ["AGENT_MAX_CONCURRENCY"] = str(args.max_concurrency)
+    if args.queue_size != None:
+        os.environ["AGENT_QUEUE_SIZE"] = str(args.queue_size)
 
     if args.dump_builtin_ivcap_definitions:
         from tool import dump_builtin_ivcap_definitions
@@ -76,8 +198,15 @@ def service_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
 
     import builtin_tools # registers all builtin tool
 
+    if args.batch:
+        output = args.batch_output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+        stats = asyncio.run(run_batch(args.batch, output, args.batch_concurrency))
+        exit(1 if stats["failed"] > 0 else 0)
+
     return args
 
+agent_pool = AgentPool()
+
 class ModeE(StrEnum):
     Chat = "chat"
     Query = "query"
@@ -88,30 +217,246 @@ class ServiceRequest(BaseModel):
     tools: List[str] = Field([], description="The tools to use while processing this request", examples=[["multiply"]])
     model: Optional[str] = Field("gpt-4-turbo", description="The model to use for the agent")
     mode: ModeE = Field(ModeE.Query, description="specifies if the message is a chat or a query")
+    priority: Optional[PriorityE] = Field(None, description="Priority class when runs are queued. Defaults to 'interactive' for chats and 'batch' for queries")
+    session_id: Optional[str] = Field(None, pattern=sessions.SESSION_ID_PATTERN, description="The chat session to continue (only used in 'chat' mode). A new session is started if not set")
     verbose: bool = Field(False, description="Whether to also return events produced during execution")
+    bypass_llm_cache: bool = Field(False, description="Always query the LLM, even if the LLM response cache is enabled")
+    parallel_tools: bool = Field(False, description="Use an agent which can execute several independent tool calls of a step concurrently (requires a function calling model)")
+    max_parallel_tools: Optional[int] = Field(None, gt=0, description="Max. number of tool calls executed concurrently (with 'parallel_tools')")
+    delta_messages: bool = Field(False, description="If set, LLM events only contain the messages added since the run's previous LLM event")
+    job_deadline: Optional[float] = Field(None, description="Max. time in seconds to wait for the results of remote tools in this request")
+    timings: bool = Field(False, description="Whether to also return how much time the phases of this request took")
+    coalesce: bool = Field(True, description="Share the run of an identical query already in flight instead of executing it again (only used in 'query' mode)")
 
 class ServiceResponse(BaseModel):
     jschema: str = Field("urn:sd-core:schema.llama-agent.1", alias="$schema")
     response: str = Field(description="The response to a query or chat")
     msg: str = Field(description="The message to a chat or query", examples=["what is 2 * 5"])
+    session_id: Optional[str] = Field(None, description="The chat session to use for follow-up messages (only in 'chat' mode)")
+    events: Optional[List[dict[str, Any]]] = Field(None, description="Events produced during execution (if 'verbose' was requested)")
+    timings: Optional[dict[str, Any]] = Field(None, description="Seconds spent in each phase of the request (if 'timings' was requested)")
+
+class ErrorResponse(BaseModel):
+    jschema: str = Field("urn:sd-core:schema.llama-agent.error.1", alias="$schema")
+    message: str = Field(description="Description of what went wrong")
 
-async def agent_runner(req: ServiceRequest) -> ServiceResponse:
+async def agent_runner(req: ServiceRequest, request: Request) -> ServiceResponse:
     """Provides the ability to request a LlamaIndex ReAct agent to execute
     the query or chat requested."""
 
-    llm = create_openai_client(req.model)
-    tools = [resolve_tool(urn) for urn in req.tools]
-    agent = ReActAgent.from_tools(tools, llm=llm, verbose=False)
-    response = await agent.aquery(req.msg)
+    ticket = getattr(request.state, "admission", None)
+    loop = _app_loop
+    if loop is not None and loop is not asyncio.get_running_loop():
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(execute_request(req, ticket=ticket), loop))
+    return await execute_request(req, ticket=ticket)
+
+async def execute_request(
+    req: ServiceRequest,
+    verbose: Optional[bool] = None,
+    ticket: Optional[scheduler.Ticket] = None,
+    coalesce: bool = True,
+    block: bool = False,
+) -> ServiceResponse:
+    """Execute 'req' once admitted by the scheduler, using 'ticket' if it
+    was already admitted (see 'admission_control'), or waiting as long as it
+    takes to be admitted if 'block' is set. Unless 'coalesce' is False,
+    identical queries in flight share a single run."""
+    if verbose is None:
+        verbose = req.verbose
+    with timings.request() as t:
+        if coalesce and req.coalesce and req.mode == ModeE.Query:
+            joined = False
+
+            def on_join():
+                nonlocal joined
+                joined = True
+
+            started = time.perf_counter()
+            resp = await coalescing.in_flight.run(
+                coalescing_key(req, verbose),
+                lambda run_ticket: _execute_request(req, verbose, run_ticket, block),
+                ticket,
+                on_join,
+                # no need to keep the slot (or place in the queue) it was admitted with
+                release=scheduler.scheduler.cancel if scheduler.scheduler is not None else None,
+            )
+            if joined:
+                timings.record("coalesced", time.perf_counter() - started)
+            resp = resp.model_copy() # shared with the other callers
+        else:
+            resp = await _execute_request(req, verbose, ticket, block)
+    if req.timings:
+        resp.timings = t.report()
+    return resp
+
+async def _execute_request(
+    req: ServiceRequest,
+    verbose: bool,
+    ticket: Optional[scheduler.Ticket],
+    block: bool,
+) -> ServiceResponse:
+    sched = scheduler.scheduler
+    priority = request_priority(req.mode, req.priority)
+    async with (sched.slot(priority, ticket, block) if sched is not None else nullcontext()):
+        with metrics.agent_run():
+            if not verbose:
+                return await run_agent(req)
+            records = []
+            subscription = register_event_handler(records.append, req.delta_messages)
+            try:
+                resp = await run_agent(req)
+            finally:
+                unregister_event_handler(subscription)
+            with timings.phase("events"):
+                resp.events = [d for d in map(streaming.event_to_dict, records) if d is not None]
+            return resp
+
+def coalescing_key(req: ServiceRequest, verbose: bool) -> str:
+    # everything which can change the response, but not how it's scheduled or timed
+    d = req.model_dump(exclude={"priority", "coalesce", "timings", "verbose"})
+    return coalescing.request_key(dict(d, verbose=verbose))
+
+def request_priority(mode: ModeE, priority: Optional[PriorityE]) -> PriorityE:
+    if priority is not None:
+        return priority
+    return PriorityE.Interactive if mode == ModeE.Chat else PriorityE.Batch
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Admit agent requests to the scheduler, or reject them right away if the
+    runner is overloaded, before a job is even created for them"""
+    sched = scheduler.scheduler
+    if sched is not None and request.method == "POST" and request.url.path in ("/", "/stream"):
+        try:
+            d = json.loads(await request.body())
+            priority = request_priority(ModeE(d.get("mode", ModeE.Query)), d.get("priority") and PriorityE(d["priority"]))
+        except (ValueError, AttributeError):
+            priority = PriorityE.Batch # malformed requests are rejected by the route itself
+            d = None
+        key = _coalescing_key(d) if request.url.path == "/" else None
+        if key is not None and coalescing.in_flight.has(key):
+            return await call_next(request) # joins that run, doesn't need a slot of its own
+        try:
+            ticket = sched.admit(priority)
+        except scheduler.Rejected as e:
+            return _rejected(priority, e)
+        # picked up by 'execute_request', unless the request fails before it even gets there
+        request.state.admission = ticket
+        if key is not None:
+            # identical requests arriving before this one executes join it
+            coalescing.in_flight.reserve(key, ticket)
+        response = None
+        try:
+            response = await call_next(request)
+        finally:
+            if response is None or response.status_code >= 400:
+                sched.cancel(ticket)
+                if key is not None:
+                    coalescing.in_flight.release(key, ticket)
+            else:
+                sched.cancel_later(ticket, ADMISSION_CLAIM_TIMEOUT)
+                if key is not None:
+                    asyncio.get_running_loop().call_later(ADMISSION_CLAIM_TIMEOUT, coalescing.in_flight.release, key, ticket)
+        if ticket.rejection is not None and response.status_code >= 500:
+            # displaced or timed out in the queue, report it like an up-front rejection
+            return _rejected(priority, ticket.rejection)
+        return response
+    return await call_next(request)
+
+def _rejected(priority: PriorityE, e: scheduler.Rejected) -> JSONResponse:
+    logger.info(f"rejecting {priority.value} request - {e}")
+    return JSONResponse(
+        ErrorResponse(message=str(e)).model_dump(by_alias=True),
+        status_code=e.status_code,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def _coalescing_key(d: Any) -> Optional[str]:
+    # the key of a request body 'd' which may share its run, None otherwise
+    try:
+        req = ServiceRequest.model_validate(d)
+    except ValueError:
+        return None
+    if not (req.coalesce and req.mode == ModeE.Query):
+        return None
+    return coalescing_key(req, req.verbose)
+
+@app.post("/stream", tags=["ReAct Agent"], response_class=StreamingResponse)
+async def agent_stream(req: ServiceRequest, request: Request):
+    """Same as 'POST /', but streams all events produced by the agent as they happen,
+    followed by the final 'ServiceResponse'. Events are sent as Server-Sent Events,
+    or as newline delimited JSON if the 'Accept' header asks for 'application/x-ndjson'."""
+
+    media_type = streaming.SSE_MEDIA_TYPE
+    if streaming.NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        media_type = streaming.NDJSON_MEDIA_TYPE
+    on_error = lambda e: ErrorResponse(message=str(e))
+    return StreamingResponse(
+        # all events are streamed anyway, no need to also collect them for the response
+        streaming.stream_run(
+            # events are streamed from the run itself, so it can't be shared
+            lambda: execute_request(req, verbose=False, ticket=getattr(request.state, "admission", None), coalesce=False),
+            media_type, on_error, req.delta_messages,
+        ),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_agent(req: ServiceRequest) -> ServiceResponse:
+    with timings.phase("resolve_tools"):
+        tools = await resolve_tools(req.tools)
+
+    async def create_agent() -> AgentRunner:
+        if req.parallel_tools:
+            return parallel_agent.create_agent(tools, create_openai_client(req.model))
+        return ReActAgent.from_tools(tools, llm=create_openai_client(req.model), verbose=False)
+
+    key = pool_key(req.model, req.tools, tools, "parallel" if req.parallel_tools else "react")
+    deadline_token = job_wait.set_request_deadline(req.job_deadline)
+    bypass_token = llm_cache.set_bypass(req.bypass_llm_cache)
+    parallel_token = parallel_agent.set_max_parallel_tools(req.max_parallel_tools)
+    session_id = None
+    try:
+        acquiring = time.perf_counter()
+        async with agent_pool.agent(key, create_agent) as agent:
+            timings.record("agent", time.perf_counter() - acquiring)
+            if req.mode == ModeE.Chat:
+                session_id = req.session_id or sessions.new_session_id()
+                response = await run_chat(agent, session_id, req.msg)
+            else:
+                response = await agent.aquery(req.msg)
+    finally:
+        job_wait.reset_request_deadline(deadline_token)
+        llm_cache.reset_bypass(bypass_token)
+        parallel_agent.reset_max_parallel_tools(parallel_token)
     answer = response.response
-    return ServiceResponse(response=answer, msg=req.msg)
+    return ServiceResponse(response=answer, msg=req.msg, session_id=session_id)
+
+async def run_chat(agent: AgentRunner, session_id: str, msg: str):
+    """Continue the chat 'session_id' with 'msg'. The agent only holds the
+    session's history for the duration of this turn."""
+    async with sessions.turn(session_id) as turn:
+        agent.memory.set(turn.history)
+        response = await agent.achat(msg)
+        turn.update(agent.memory.get_all())
+    return response
+
+async def run_batch(input_path: str, output_path: str, concurrency: Optional[int] = None) -> dict[str, Any]:
+    """Execute all requests in the JSONL file 'input_path' with the app
+    (and therefore its pools and caches) set up as for serving."""
+    async with lifespan(app):
+        return await batch.run_batch(
+            input_path,
+            output_path,
+            ServiceRequest.model_validate_json,
+            # the batch itself limits the number of requests queued
+            lambda req: execute_request(req, block=True),
+            lambda e: ErrorResponse(message=str(e)),
+            concurrency or batch.BATCH_CONCURRENCY,
+        )
 
 def create_openai_client(model: str) -> OpenAI:
-    base_url = os.getenv("LITELLM_PROXY")
-    if base_url == None:
-        return OpenAI(model=model)
-    else:
-        return OpenAI(model=model, api_base=f"{base_url}/v1", api_key="not-needed")
+    return llm.get_llm(model)
 
 add_tool_api_route(app, "/", agent_runner, opts=ToolOptions(tags=["ReAct Agent"], service_id="/"))
 
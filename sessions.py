@@ -0,0 +1,326 @@
+#
+# Chat sessions, so a follow-up chat message doesn't need to resend
+# the entire conversation.
+#
+# The history of every session is kept in a pluggable store, selected with
+# SESSION_STORE:
+#
+#   memory        in-memory LRU (default, lost on restart)
+#   file:<dir>    one JSON file per session in <dir>
+#   dbm:<file>    a local key-value database (python's 'dbm')
+#
+# Histories are cut to the most recent SESSION_TOKEN_LIMIT tokens, and
+# sessions which haven't been used for SESSION_TTL seconds are dropped.
+#
+import abc
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import dbm
+import json
+import os
+import logging
+import time
+from typing import Any, AsyncIterator, Optional, Sequence
+from uuid import uuid4
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.utils import get_tokenizer
+
+logger = logging.getLogger("sessions")
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 3600))
+SESSION_MAX_SIZE = int(os.environ.get("SESSION_MAX_SIZE", 1000))
+SESSION_TOKEN_LIMIT = int(os.environ.get("SESSION_TOKEN_LIMIT", 4000))
+# min. interval in seconds between two sweeps for expired sessions
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", 300))
+
+# session ids end up in file names
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_\-]{1,128}$"
+
+class SessionStore(abc.ABC):
+    """Keeps the chat history of sessions. Subclasses implement the actual storage
+    ('_load', '_save', '_delete', and optionally '_sweep') of records of the form
+    {"messages": [...], "updated_at": <epoch seconds>}"""
+
+    kind = "abstract"
+
+    def __init__(self, ttl: float = SESSION_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._last_sweep = time.time()
+
+    def get(self, session_id: str) -> Optional[list[ChatMessage]]:
+        """Returns the history of 'session_id', or None if the session is unknown or expired"""
+        rec = self._load(session_id)
+        if rec is not None and time.time() - rec.get("updated_at", 0) > self.ttl:
+            self._delete(session_id)
+            self.expired += 1
+            rec = None
+        if rec is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [ChatMessage.model_validate(m) for m in rec.get("messages", [])]
+
+    def put(self, session_id: str, messages: Sequence[ChatMessage]):
+        rec = {
+            "messages": [m.model_dump(mode="json") for m in messages],
+            "updated_at": time.time(),
+        }
+        self._save(session_id, rec)
+        now = time.time()
+        if now - self._last_sweep > SESSION_SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.expired += self._sweep(now - self.ttl)
+
+    def remove(self, session_id: str):
+        self._delete(session_id)
+
+    def close(self):
+        pass
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "store": self.kind,
+            "sessions": self._size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+        }
+
+    @abc.abstractmethod
+    def _load(self, session_id: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    def _save(self, session_id: str, rec: dict):
+        ...
+
+    @abc.abstractmethod
+    def _delete(self, session_id: str):
+        ...
+
+    def _sweep(self, updated_before: float) -> int:
+        """Delete all sessions last updated before 'updated_before'. Returns their number."""
+        return 0
+
+    def _size(self) -> Optional[int]:
+        return None
+
+class MemorySessionStore(SessionStore):
+    """In-memory LRU, keeping at most 'max_size' sessions"""
+
+    kind = "memory"
+
+    def __init__(self, ttl: float = SESSION_TTL, max_size: int = SESSION_MAX_SIZE):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self.evictions = 0
+        self._sessions: OrderedDict[str, dict] = OrderedDict()
+
+    def stats(self) -> dict[str, Any]:
+        return dict(super().stats(), evictions=self.evictions)
+
+    def _load(self, session_id: str) -> Optional[dict]:
+        rec = self._sessions.get(session_id)
+        if rec is not None:
+            self._sessions.move_to_end(session_id)
+        return rec
+
+    def _save(self, session_id: str, rec: dict):
+        self._sessions[session_id] = rec
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def _delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def _sweep(self, updated_before: float) -> int:
+        # least recently used sessions are at the front
+        count = 0
+        while self._sessions:
+            sid, rec = next(iter(self._sessions.items()))
+            if rec["updated_at"] >= updated_before:
+                break
+            del self._sessions[sid]
+            count += 1
+        return count
+
+    def _size(self) -> int:
+        return len(self._sessions)
+
+class FileSessionStore(SessionStore):
+    """Stores every session as a JSON file in 'directory'"""
+
+    kind = "file"
+
+    def __init__(self, directory: str, ttl: float = SESSION_TTL):
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _load(self, session_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(session_id), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"cannot read session '{session_id}' - {e}")
+            return None
+
+    def _save(self, session_id: str, rec: dict):
+        path = self._path(session_id)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as file:
+            json.dump(rec, file, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def _delete(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _sweep(self, updated_before: float) -> int:
+        count = 0
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".json") and e.stat().st_mtime < updated_before:
+                try:
+                    os.remove(e.path)
+                    count += 1
+                except FileNotFoundError:
+                    pass
+        return count
+
+    def _size(self) -> int:
+        return sum(1 for e in os.scandir(self.directory) if e.name.endswith(".json"))
+
+class DbmSessionStore(SessionStore):
+    """Stores all sessions in the local key-value database 'path'"""
+
+    kind = "dbm"
+
+    def __init__(self, path: str, ttl: float = SESSION_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self._db = dbm.open(path, 'c')
+
+    def _load(self, session_id: str) -> Optional[dict]:
+        v = self._db.get(session_id.encode())
+        return json.loads(v) if v is not None else None
+
+    def _save(self, session_id: str, rec: dict):
+        self._db[session_id.encode()] = json.dumps(rec, separators=(",", ":"))
+
+    def _delete(self, session_id: str):
+        try:
+            del self._db[session_id.encode()]
+        except KeyError:
+            pass
+
+    def _sweep(self, updated_before: float) -> int:
+        expired = [k for k in self._db.keys() if json.loads(self._db[k]).get("updated_at", 0) < updated_before]
+        for k in expired:
+            del self._db[k]
+        return len(expired)
+
+    def _size(self) -> int:
+        return len(self._db)
+
+    def close(self):
+        self._db.close()
+
+def create_store(spec: Optional[str]) -> SessionStore:
+    """Returns the store described by 'spec' ('memory', 'file:<dir>' or 'dbm:<file>')"""
+    kind, _, arg = (spec or "memory").partition(":")
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "file" and arg:
+        return FileSessionStore(arg)
+    if kind == "dbm" and arg:
+        return DbmSessionStore(arg)
+    raise ValueError(f"unsupported session store '{spec}'")
+
+def new_session_id() -> str:
+    return str(uuid4())
+
+class Turn:
+    """A single chat turn of a session"""
+
+    def __init__(self, session_id: str, history: list[ChatMessage]):
+        self.session_id = session_id
+        self.history = history
+        self._messages: Optional[list[ChatMessage]] = None
+
+    def update(self, messages: Sequence[ChatMessage]):
+        """Set the session's history at the end of this turn"""
+        self._messages = list(messages)
+
+@asynccontextmanager
+async def turn(session_id: str) -> AsyncIterator[Turn]:
+    """Start a new turn of 'session_id'. Turns of the same session are executed
+    one after the other. The updated history is saved at the end, unless the turn failed."""
+    lock = _locks.get(session_id)
+    if lock is None:
+        lock = _locks[session_id] = asyncio.Lock()
+    _lock_users[session_id] = _lock_users.get(session_id, 0) + 1
+    try:
+        async with lock:
+            t = Turn(session_id, store.get(session_id) or [])
+            yield t
+            if t._messages is not None:
+                store.put(session_id, history_window(t._messages))
+    finally:
+        _lock_users[session_id] -= 1
+        if _lock_users[session_id] == 0:
+            del _lock_users[session_id]
+            del _locks[session_id]
+
+def history_window(messages: Sequence[ChatMessage], token_limit: int = SESSION_TOKEN_LIMIT) -> list[ChatMessage]:
+    """Returns the most recent 'messages' fitting into 'token_limit' tokens.
+    The window always starts with a user message."""
+    tokenizer = get_tokenizer()
+    total = 0
+    start = len(messages)
+    while start > 0:
+        n = len(tokenizer(messages[start - 1].content or ""))
+        if total + n > token_limit:
+            break
+        total += n
+        start -= 1
+    while start < len(messages) and messages[start].role != MessageRole.USER:
+        start += 1
+    if start > 0:
+        _stats["trimmed"] += 1
+    return list(messages[start:])
+
+def start(spec: Optional[str]):
+    """Called on app startup to use the session store described by 'spec'"""
+    global store
+    if spec:
+        store.close()
+        store = create_store(spec)
+        logger.info(f"Using '{store.kind}' session store")
+
+def stop():
+    store.close()
+
+def stats() -> dict[str, Any]:
+    return dict(store.stats(), active_turns=len(_locks), **_stats)
+
+store: SessionStore = MemorySessionStore()
+
+### INTERNAL
+
+_locks: dict[str, asyncio.Lock] = {}
+_lock_users: dict[str, int] = {}
+_stats = {"trimmed": 0}
@@ -0,0 +1,123 @@
+#
+# Streams the events of an agent run to the caller while it is executing,
+# either as Server-Sent Events or as newline delimited JSON.
+#
+# Every stream has a bounded buffer. Events are produced synchronously, so
+# they can't wait for the consumer. Instead, the run's async steps (LLM and
+# tool calls) call 'wait_for_consumer' before they start and so pause the
+# run while the buffer is full.
+#
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+import os
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from pydantic import BaseModel
+
+from events import materialize, register_event_handler, unregister_event_handler
+
+logger = logging.getLogger("streaming")
+
+STREAM_BUFFER_SIZE = int(os.environ.get("STREAM_BUFFER_SIZE", 64))
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+class EventStream:
+    """Buffer between an agent run (producer) and the HTTP response (consumer)"""
+
+    def __init__(self, maxsize: int = STREAM_BUFFER_SIZE):
+        self.maxsize = maxsize
+        self._items: deque[Any] = deque() # EventRecords and the final result
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._closed = False
+
+    def put(self, ev: Any):
+        if self._closed:
+            return
+        self._items.append(ev)
+        self._readable.set()
+        if len(self._items) >= self.maxsize:
+            self._writable.clear()
+
+    def close(self):
+        self._closed = True
+        self._readable.set()
+        self._writable.set()
+
+    async def wait_writable(self):
+        await self._writable.wait()
+
+    async def get(self) -> Optional[Any]:
+        """Returns the next item, or None once the stream is closed and drained"""
+        while not self._items:
+            if self._closed:
+                return None
+            self._readable.clear()
+            await self._readable.wait()
+        ev = self._items.popleft()
+        if len(self._items) < self.maxsize:
+            self._writable.set()
+        return ev
+
+async def wait_for_consumer():
+    """Pause the current agent run while the consumer of its event stream is behind"""
+    stream = _current_stream.get()
+    if stream is not None:
+        await stream.wait_writable()
+
+async def stream_run(
+    run: Callable[[], Awaitable[BaseModel]],
+    media_type: str = SSE_MEDIA_TYPE,
+    on_error: Optional[Callable[[Exception], BaseModel]] = None,
+    delta_messages: bool = False,
+) -> AsyncIterator[str]:
+    """Execute 'run' and yield all its events, followed by its result, formatted
+    according to 'media_type'. The run is cancelled if the consumer goes away."""
+    stream = EventStream()
+
+    async def producer() -> BaseModel:
+        _current_stream.set(stream)
+        subscription = register_event_handler(stream.put, delta_messages)
+        try:
+            result = await run()
+            stream.put(result)
+            return result
+        except Exception as e:
+            logger.warning(f"streamed run failed - {e}")
+            if on_error is not None:
+                stream.put(on_error(e))
+        finally:
+            unregister_event_handler(subscription)
+            stream.close()
+
+    task = asyncio.create_task(producer())
+    try:
+        while True:
+            ev = await stream.get()
+            if ev is None:
+                break
+            ev = materialize(ev) # only now pay for creating the pydantic event
+            if ev is not None:
+                yield _format(ev, media_type)
+    finally:
+        if not task.done():
+            task.cancel()
+
+def event_to_dict(ev: Any) -> Optional[dict[str, Any]]:
+    ev = materialize(ev)
+    return ev.model_dump(mode="json", by_alias=True) if ev is not None else None
+
+### INTERNAL
+
+_current_stream: ContextVar[Optional[EventStream]] = ContextVar("event_stream", default=None)
+
+def _format(ev: BaseModel, media_type: str) -> str:
+    data = ev.model_dump_json(by_alias=True)
+    if media_type == NDJSON_MEDIA_TYPE:
+        return data + "\n"
+    return f"data: {data}\n\n"
@@ -1,4 +1,5 @@
 from tool import register_builtin_tool
+from executors import ExecutionClass
 
 # tool simulating IVCAP tool - requires json file
 # load_example_tool('examples/multiply-tool.json', lambda a, b: a * b)
@@ -33,4 +34,4 @@ def is_prime(number: int) -> R:
         if number % i == 0 or number % (i + 2) == 0:
             return R(number=number, is_prime=False)
     return R(number=number, is_prime=True)
-register_builtin_tool(is_prime)
\ No newline at end of file
+register_builtin_tool(is_prime, deterministic=True, execution=ExecutionClass.Process)
\ No newline at end of file
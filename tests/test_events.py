@@ -0,0 +1,99 @@
+#
+# Event routing under concurrency: overlapping agent runs on the same event
+# loop must each receive only their own events (see 'register_event_handler').
+#
+import asyncio
+import contextvars
+import random
+
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
+from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMChatStartEvent
+
+import events
+from events import LLMChatEvent, ToolEvent, register_event_handler, unregister_event_handler
+
+RUNS = 300
+STEPS = 5
+
+async def fake_run(i: int) -> list:
+    """Issues the events of an agent run with STEPS steps, each an LLM call
+    followed by a tool call in a task of its own, yielding in between"""
+    records = []
+    subscription = register_event_handler(records.append)
+    try:
+        for step in range(STEPS):
+            # all runs use the same span ids, spans must not leak between runs
+            span_id = f"llm-{step}"
+            messages = [ChatMessage(role=MessageRole.USER, content=f"run {i}")]
+            events._dispatcher.event(LLMChatStartEvent(messages=messages, additional_kwargs={}, model_dict={}, span_id=span_id))
+            await asyncio.sleep(random.random() * 0.001)
+            response = ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=f"answer {i}"))
+            events._dispatcher.event(LLMChatEndEvent(messages=messages, response=response, span_id=span_id))
+
+            async def call_tool():
+                id = ToolEvent.dispatch_tool_start(f"tool{i}", step=step)
+                await asyncio.sleep(random.random() * 0.001)
+                ToolEvent.dispatch_tool_end(id, i, f"tool{i}", step=step)
+
+            await asyncio.create_task(call_tool())
+    finally:
+        unregister_event_handler(subscription)
+    return [events.materialize(r) for r in records]
+
+def test_concurrent_runs_receive_only_their_own_events():
+    async def main():
+        return await asyncio.gather(*[fake_run(i) for i in range(RUNS)])
+
+    results = asyncio.run(main())
+    for i, evs in enumerate(results):
+        assert len(evs) == 4 * STEPS
+        llm_events = [e for e in evs if isinstance(e, LLMChatEvent)]
+        tool_events = [e for e in evs if isinstance(e, ToolEvent)]
+        assert len(llm_events) == 2 * STEPS
+        assert len(tool_events) == 2 * STEPS
+        for e in llm_events:
+            assert [m.content for m in e.requests] == [f"run {i}"]
+        for start, end in zip(llm_events[::2], llm_events[1::2]):
+            assert start.id == end.id
+            assert end.response.content == f"answer {i}"
+        for e in tool_events:
+            assert e.tool_name == f"tool{i}"
+        assert {e.response for e in tool_events if e.response is not None} == {i}
+    assert events.stats()["handlers"] == 0
+
+def test_events_outside_of_a_run_are_dropped():
+    records = []
+
+    async def main():
+        subscription = register_event_handler(records.append)
+        try:
+            ToolEvent.dispatch_tool_start("mine")
+            # a context which never registered a handler
+            contextvars.Context().run(ToolEvent.dispatch_tool_start, "unrelated")
+        finally:
+            unregister_event_handler(subscription)
+        ToolEvent.dispatch_tool_start("after")
+
+    asyncio.run(main())
+    assert [events.materialize(r).tool_name for r in records] == ["mine"]
+
+def test_runs_may_register_the_same_handler():
+    received = []
+
+    async def run(name: str, duration: float):
+        subscription = register_event_handler(received.append)
+        try:
+            ToolEvent.dispatch_tool_start(f"{name}-start")
+            await asyncio.sleep(duration)
+            ToolEvent.dispatch_tool_start(f"{name}-end")
+        finally:
+            unregister_event_handler(subscription)
+
+    async def main():
+        # 'a' unregisters while 'b' is still running
+        await asyncio.gather(run("a", 0.01), run("b", 0.05))
+
+    asyncio.run(main())
+    names = sorted(events.materialize(r).tool_name for r in received)
+    assert names == ["a-end", "a-start", "b-end", "b-start"]
+    assert events.stats()["handlers"] == 0
@@ -0,0 +1,164 @@
+#
+# Waiting for IVCAP tool jobs (see 'job_wait.py') against a stub job server.
+#
+import asyncio
+import time
+from typing import Optional
+
+from fastapi import FastAPI
+import httpx
+import pytest
+
+import http_client
+import job_wait
+
+JOB_URL = "http://ivcap.test/1/jobs/job-1"
+SUCCEEDED = {"status": "succeeded", "result-content": {"value": 10}}
+
+class JobServer:
+    """Answers polls of JOB_URL with 'running' until 'polls' were made, then with 'job'"""
+
+    def __init__(self, polls: int = 0, retry_after: Optional[str] = None, status_code: int = 200, job: dict = SUCCEEDED):
+        self.polls = polls
+        self.job = job
+        self.retry_after = retry_after
+        self.status_code = status_code
+        self.requests: list[httpx.Request] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if len(self.requests) > self.polls:
+            return httpx.Response(200, json=self.job)
+        headers = {"Retry-After": self.retry_after} if self.retry_after is not None else {}
+        return httpx.Response(self.status_code, json={"status": "running"}, headers=headers)
+
+@pytest.fixture
+def server(monkeypatch):
+    """Returns a function to install a stub job server for JOB_URL"""
+    def install(**kwargs) -> JobServer:
+        srv = JobServer(**kwargs)
+        pool = http_client.HostPool("http://ivcap.test")
+        pool.client = httpx.AsyncClient(transport=httpx.MockTransport(srv.handle))
+        monkeypatch.setitem(http_client._pools, "http://ivcap.test", pool)
+        return srv
+    return install
+
+@pytest.fixture
+def delays(monkeypatch) -> list[float]:
+    """Records the delays between polls, without actually waiting"""
+    recorded = []
+    sleep = asyncio.sleep
+
+    async def record(delay, *args, **kwargs):
+        recorded.append(round(delay, 6))
+        await sleep(0)
+
+    monkeypatch.setattr(job_wait.asyncio, "sleep", record)
+    return recorded
+
+@pytest.fixture(autouse=True)
+def polling(monkeypatch):
+    monkeypatch.setattr(job_wait, "JOB_POLL_INITIAL", 0.01)
+    monkeypatch.setattr(job_wait, "JOB_POLL_MULTIPLIER", 2)
+    monkeypatch.setattr(job_wait, "JOB_POLL_MAX", 0.04)
+    monkeypatch.setattr(job_wait, "JOB_POLL_JITTER", 0)
+
+def wait(deadline: float = 10, **kwargs):
+    return job_wait.wait_for_job(JOB_URL, "multiply", deadline=time.monotonic() + deadline, **kwargs)
+
+def test_backoff(server, delays):
+    srv = server(polls=4)
+    assert asyncio.run(wait()) == {"value": 10}
+    assert delays == [0.01, 0.02, 0.04, 0.04, 0.04]
+    assert len(srv.requests) == 5
+    assert srv.requests[0].url.params["with-result-content"] == "true"
+
+def test_backoff_jitter(server, delays, monkeypatch):
+    monkeypatch.setattr(job_wait, "JOB_POLL_JITTER", 0.5)
+    server(polls=3)
+    asyncio.run(wait())
+    assert delays[0] == 0.01
+    for d, backoff in zip(delays[1:], [0.02, 0.04, 0.04]):
+        assert backoff * 0.5 <= d <= backoff * 1.5
+
+def test_retry_after(server, delays):
+    server(polls=2, retry_after="0.5", status_code=202)
+    assert asyncio.run(wait(retry_after=1.5)) == {"value": 10}
+    assert delays == [1.5, 0.5, 0.5]
+
+def test_retry_after_zero_falls_back_to_floor(server, delays):
+    server(polls=3, retry_after="0", status_code=202)
+    asyncio.run(wait(retry_after=0))
+    assert delays == [0.01, 0.01, 0.01, 0.01]
+
+def test_retry_after_header():
+    def parse(v: str) -> Optional[float]:
+        return job_wait.retry_after(httpx.Response(202, headers={"Retry-After": v}))
+
+    assert parse("3") == 3
+    assert parse("-1") == 0
+    assert parse("soon") is None
+    assert job_wait.retry_after(httpx.Response(202)) is None
+    date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 28 <= parse(date) <= 30
+
+def test_deadline_timeout(server):
+    srv = server(polls=1000)
+    timeouts = job_wait.stats()["timeouts"]
+    started = time.monotonic()
+    with pytest.raises(job_wait.JobTimeoutError):
+        asyncio.run(wait(deadline=0.2))
+    assert time.monotonic() - started < 1
+    assert 1 < len(srv.requests) < 1000
+    assert job_wait.stats()["timeouts"] == timeouts + 1
+    assert job_wait.stats()["active"] == 0
+
+def test_request_deadline_caps_tool_deadline(monkeypatch):
+    monkeypatch.setitem(job_wait.tool_deadlines, "slow", 1800)
+    now = time.monotonic()
+    assert job_wait.deadline_for("slow") >= now + 1800
+    token = job_wait.set_request_deadline(5)
+    try:
+        assert job_wait.deadline_for("slow") <= time.monotonic() + 5
+    finally:
+        job_wait.reset_request_deadline(token)
+
+def test_failed_job(server, delays):
+    server(polls=1, job={"status": "failed", "error-message": "boom"})
+    with pytest.raises(job_wait.JobWaitError, match="boom"):
+        asyncio.run(wait())
+
+def test_callback(server, monkeypatch):
+    monkeypatch.setattr(job_wait, "JOB_CALLBACK_URL", "http://runner.test/")
+    monkeypatch.setattr(job_wait, "JOB_CALLBACK_POLL", 30)
+    srv = server(polls=1000)
+    # registered like in 'service.py'
+    app = FastAPI()
+    app.add_api_route("/_callbacks/jobs/{token}", job_wait.job_callback, methods=["POST"])
+
+    async def main():
+        token, headers = job_wait.create_callback()
+        url = headers[job_wait.JOB_CALLBACK_HEADER]
+        assert url == f"http://runner.test/_callbacks/jobs/{token}"
+        waiting = asyncio.create_task(wait(callback_token=token))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://runner.test") as client:
+            r = await client.post("/_callbacks/jobs/unknown", json={"status": "succeeded"})
+            assert r.status_code == 404
+            r = await client.post(url, json={"status": "running"})
+            assert r.json() == {"status": "ignored"}
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            r = await client.post(url, json={"status": "succeeded", "result-content": {"value": 42}})
+            assert r.json() == {"status": "ok"}
+            result = await asyncio.wait_for(waiting, 1)
+            # the callback was released with the wait
+            r = await client.post(url, json={"status": "succeeded"})
+            assert r.status_code == 404
+        return result
+
+    callbacks = job_wait.stats()["callbacks"]
+    assert asyncio.run(main()) == {"value": 42}
+    assert job_wait.stats()["callbacks"] == callbacks + 1
+    assert job_wait.stats()["pending_callbacks"] == 0
+    assert len(srv.requests) == 1 # the first poll, before the callback poll interval
@@ -0,0 +1,57 @@
+#
+# LLM response cache (see 'llm_cache.py'): cached responses, in particular
+# those with tool calls, must be usable like fresh ones.
+#
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
+from llama_index.llms.openai import OpenAI
+from openai.types.chat import ChatCompletionMessageToolCall
+
+import llm_cache
+
+def tool_call_response() -> ChatResponse:
+    tc = ChatCompletionMessageToolCall(
+        id="call_1",
+        type="function",
+        function={"name": "multiply", "arguments": '{"a": 2, "b": 5}'},
+    )
+    msg = ChatMessage(role=MessageRole.ASSISTANT, content=None, additional_kwargs={"tool_calls": [tc]})
+    return ChatResponse(message=msg, raw={"id": "chatcmpl-1"}, additional_kwargs={"total_tokens": 12})
+
+def tool_calls(response: ChatResponse) -> list[tuple[str, str, dict]]:
+    llm = OpenAI(model="gpt-4o", api_key="-")
+    return [(t.tool_id, t.tool_name, t.tool_kwargs) for t in llm.get_tool_calls_from_response(response)]
+
+def key() -> str:
+    return llm_cache.chat_key([ChatMessage(role=MessageRole.USER, content="what is 2 * 5")], {"model": "gpt-4o"})
+
+def test_memory_round_trip():
+    cache = llm_cache.LLMCache()
+    cache.put(key(), tool_call_response())
+    response = cache.get(key())
+    assert response.raw is None
+    assert tool_calls(response) == [("call_1", "multiply", {"a": 2, "b": 5})]
+    assert cache.stats()["memory_hits"] == 1
+
+def test_disk_round_trip(tmp_path):
+    cache = llm_cache.LLMCache(directory=str(tmp_path))
+    cache.put(key(), tool_call_response())
+    cache = llm_cache.LLMCache(directory=str(tmp_path)) # e.g. after a restart
+    response = cache.get(key())
+    assert cache.stats()["disk_hits"] == 1
+    assert response.additional_kwargs == {"total_tokens": 12}
+    assert tool_calls(response) == [("call_1", "multiply", {"a": 2, "b": 5})]
+
+def test_disk_round_trip_without_tool_calls(tmp_path):
+    cache = llm_cache.LLMCache(directory=str(tmp_path))
+    msg = ChatMessage(role=MessageRole.ASSISTANT, content="10")
+    cache.put(key(), ChatResponse(message=msg))
+    response = llm_cache.LLMCache(directory=str(tmp_path)).get(key())
+    assert response.message.content == "10"
+    assert "tool_calls" not in response.message.additional_kwargs
+
+def test_expired_entries_are_removed(tmp_path):
+    cache = llm_cache.LLMCache(ttl=-1, directory=str(tmp_path))
+    cache.put(key(), tool_call_response())
+    assert cache.get(key()) is None
+    assert list(tmp_path.iterdir()) == []
+    assert cache.stats()["expired"] == 2 # memory and disk
@@ -0,0 +1,60 @@
+#
+# Prometheus metrics (see 'metrics.py'): per-tool series are labelled by the
+# tool's URN, so tools of the same name from different services stay apart.
+#
+import asyncio
+
+import httpx
+
+import http_client
+import metrics
+import tool
+
+IVCAP = "http://ivcap.test"
+AGENT_POOL = {"in_use": 0, "idle": 0, "hits": 0, "misses": 0, "hit_rate": 0}
+
+def definition(urn: str) -> dict:
+    return {
+        "$schema": tool.TOOL_SCHEMA,
+        "id": urn,
+        "name": "multiply",
+        "service-id": urn,
+        "description": "Multiplies two integers",
+        "fn_signature": "multiply(a: int, b: int) -> int",
+        "fn_schema": {
+            "type": "object",
+            "properties": {"a": {"type": "integer"}, "b": {"type": "integer"}},
+            "required": ["a", "b"],
+        },
+    }
+
+def multiply_builtin(a: int, b: int) -> int:
+    """Multiplies two integers"""
+    return a * b
+
+def handle(request: httpx.Request) -> httpx.Response:
+    if "fails" in request.url.path:
+        return httpx.Response(500)
+    return httpx.Response(200, json=10)
+
+def test_tool_series_are_labelled_by_urn(monkeypatch):
+    pool = http_client.HostPool(IVCAP)
+    pool.client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    monkeypatch.setitem(http_client._pools, IVCAP, pool)
+    monkeypatch.setattr(tool, "IVCAP_BASE_URL", IVCAP)
+    urns = ["urn:ivcap:service:works", "urn:ivcap:service:fails"]
+    remote = [tool._create_url_tool(tool._tool_url(urn), definition(urn), urn) for urn in urns]
+    builtin = tool.register_builtin_tool(multiply_builtin)
+
+    async def main():
+        await remote[0].acall(a=2, b=5)
+        await asyncio.gather(remote[1].acall(a=2, b=5), return_exceptions=True)
+        await builtin.acall(a=2, b=5)
+
+    asyncio.run(main())
+    text = metrics.render(AGENT_POOL)
+    for urn in [*urns, tool.BUILTIN_URN_PREFIX + "multiply_builtin"]:
+        assert f'llama_agent_tool_call_duration_seconds_count{{tool="{urn}"}} 1' in text
+    assert 'llama_agent_tool_call_errors_total{tool="urn:ivcap:service:fails"} 1' in text
+    assert 'llama_agent_tool_call_errors_total{tool="urn:ivcap:service:works"} 0' in text
+    assert 'tool="multiply"' not in text
@@ -0,0 +1,120 @@
+#
+# Chat session stores (see 'sessions.py'): every store keeps, expires and
+# sweeps histories the same way.
+#
+import asyncio
+import time
+from typing import Optional
+
+import pytest
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+
+import sessions
+
+def history(*contents: str) -> list[ChatMessage]:
+    roles = [MessageRole.USER, MessageRole.ASSISTANT]
+    return [ChatMessage(role=roles[i % 2], content=c) for i, c in enumerate(contents)]
+
+@pytest.fixture(params=["memory", "file", "dbm"])
+def store_spec(request, tmp_path) -> str:
+    if request.param == "memory":
+        return "memory"
+    return f"{request.param}:{tmp_path / 'sessions'}"
+
+def create(spec: str, ttl: float = sessions.SESSION_TTL) -> sessions.SessionStore:
+    store = sessions.create_store(spec)
+    store.ttl = ttl
+    return store
+
+def test_round_trip(store_spec):
+    store = create(store_spec)
+    msgs = history("what is 2 * 5", "10")
+    store.put("s1", msgs)
+    assert store.get("s1") == msgs
+    assert store.get("unknown") is None
+    s = store.stats()
+    assert s["store"] == store_spec.partition(":")[0]
+    assert (s["sessions"], s["hits"], s["misses"]) == (1, 1, 1)
+    store.close()
+
+def test_survives_reopening(store_spec):
+    if store_spec == "memory":
+        pytest.skip("not persistent")
+    msgs = history("hi", "hello")
+    store = create(store_spec)
+    store.put("s1", msgs)
+    store.close()
+    store = create(store_spec)
+    assert store.get("s1") == msgs
+    store.close()
+
+def test_remove(store_spec):
+    store = create(store_spec)
+    store.put("s1", history("hi"))
+    store.remove("s1")
+    store.remove("s1") # unknown sessions are ignored
+    assert store.get("s1") is None
+    store.close()
+
+def test_expiry(store_spec):
+    store = create(store_spec, ttl=0.05)
+    store.put("s1", history("hi"))
+    time.sleep(0.1)
+    assert store.get("s1") is None
+    assert store.stats()["expired"] == 1
+    assert store.stats()["sessions"] == 0
+    store.close()
+
+def test_sweep(store_spec, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_SWEEP_INTERVAL", 0)
+    store = create(store_spec, ttl=0.05)
+    store.put("old", history("hi"))
+    time.sleep(0.1)
+    store.put("new", history("hello"))
+    assert store.stats()["sessions"] == 1
+    assert store.get("new") is not None
+    store.close()
+
+def test_memory_store_evicts_least_recently_used():
+    store = sessions.MemorySessionStore(max_size=2)
+    store.put("a", history("a"))
+    store.put("b", history("b"))
+    store.get("a")
+    store.put("c", history("c"))
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats()["evictions"] == 1
+
+def test_create_store_rejects_unknown_specs():
+    for spec in ("redis:localhost", "file", "dbm:"):
+        with pytest.raises(ValueError):
+            sessions.create_store(spec)
+
+def test_incomplete_store_fails_on_creation():
+    class NoDelete(sessions.SessionStore):
+        def _load(self, session_id: str) -> Optional[dict]:
+            return None
+
+        def _save(self, session_id: str, rec: dict):
+            pass
+
+    with pytest.raises(TypeError):
+        NoDelete()
+
+def test_turns_save_history_unless_failed(monkeypatch):
+    monkeypatch.setattr(sessions, "store", sessions.MemorySessionStore())
+    monkeypatch.setattr(sessions, "get_tokenizer", lambda: str.split)
+
+    async def main():
+        async with sessions.turn("s1") as t:
+            assert t.history == []
+            t.update(history("hi", "hello"))
+        with pytest.raises(RuntimeError):
+            async with sessions.turn("s1") as t:
+                t.update(history("hi", "hello", "bye", "ciao"))
+                raise RuntimeError("failed turn")
+        async with sessions.turn("s1") as t:
+            return t.history
+
+    assert asyncio.run(main()) == history("hi", "hello")
+    assert sessions.stats()["active_turns"] == 0
@@ -0,0 +1,136 @@
+#
+# Per request latency breakdown.
+#
+# While a request is executed, the time spent in each of its phases is added
+# up in a 'RequestTimings' bound to the request's context:
+#
+#   queue           waiting to be admitted by the scheduler
+#   run             executing once admitted (everything below)
+#   resolve_tools   resolving the requested tools
+#   agent           acquiring (or creating) an agent from the pool
+#   llm_queue       waiting for a free slot of the model's LLM client
+#   llm             LLM requests
+#   tool            tool calls, including 'tool_http' and 'job_wait'
+#   tool_http       submitting tool jobs
+#   job_wait        waiting for accepted (202) tool jobs to finish
+#   events          serializing the events of a 'verbose' request
+#   coalesced       waiting for an identical query already in flight
+#
+# Phases of concurrent calls (e.g. parallel tools) overlap, so their sum can
+# exceed the request's total. Durations of LLM requests and tool calls are
+# also aggregated across requests into histograms per model and per tool,
+# queue and run durations into histograms per priority class.
+#
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Any, Iterator, Optional
+
+# upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+class Histogram:
+    """Distribution of durations over fixed buckets"""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """Returns (upper bound, number of durations <= bound) for every bucket"""
+        total = 0
+        result = []
+        for le, n in zip(BUCKETS, self.counts):
+            total += n
+            result.append((le, total))
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count > 0 else 0,
+            "buckets": {("+Inf" if le == float("inf") else str(le)): n for le, n in self.cumulative()},
+        }
+
+class RequestTimings:
+    """Time spent in each phase of a single request"""
+    __slots__ = ("started", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, list] = {} # phase -> [seconds, count]
+
+    def add(self, phase: str, seconds: float):
+        p = self.phases.get(phase)
+        if p is None:
+            p = self.phases[phase] = [0.0, 0]
+        p[0] += seconds
+        p[1] += 1
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "total": time.perf_counter() - self.started,
+            "phases": {name: {"seconds": s, "count": n} for name, (s, n) in self.phases.items()},
+        }
+
+@contextmanager
+def request() -> Iterator[RequestTimings]:
+    """Record the timings of everything executed in this context"""
+    t = RequestTimings()
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def phase(name: str, label: Optional[str] = None) -> Iterator[None]:
+    """Record the time spent in the 'with' block as 'name' (see 'record')"""
+    started = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        record(name, time.perf_counter() - started, label, failed)
+
+def record(name: str, seconds: float, label: Optional[str] = None, failed: bool = False):
+    """Add 'seconds' to phase 'name' of the current request. If 'label' (a model
+    or tool name) is given, it is also added to the histogram of (name, label),
+    and counted as error if 'failed'."""
+    t = _current.get()
+    if t is not None:
+        t.add(name, seconds)
+    if label is not None:
+        key = (name, label)
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = Histogram()
+        h.observe(seconds)
+        if failed:
+            errors[key] = errors.get(key, 0) + 1
+
+def stats() -> dict[str, Any]:
+    s: dict[str, dict[str, Any]] = {}
+    for key, h in histograms.items():
+        name, label = key
+        s.setdefault(name, {})[label] = dict(h.stats(), errors=errors.get(key, 0))
+    return s
+
+# (phase, model or tool name) -> durations
+histograms: dict[tuple[str, str], Histogram] = {}
+# (phase, model or tool name) -> number of failed calls
+errors: dict[tuple[str, str], int] = {}
+
+### INTERNAL
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
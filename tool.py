@@ -13,15 +13,27 @@ from llama_index.core.tools import BaseTool, FunctionTool
 
 import os
 import logging
+import time
 from pydantic import ConfigDict
 import requests
 
 from events import ToolEvent
+import http_client
+import job_wait
+import streaming
+import timings
+import tool_memo
+from executors import ExecutionClass
+import executors
+from tool_cache import CacheEntry, ToolCache
+from schema_compiler import CompiledSchema, compile_schema
 
 TOOL_SCHEMA = "urn:sd-core:schema:ai-tool.1"
+BUILTIN_URN_PREFIX = "urn:sd-core:llama.builtin."
 
 IVCAP_BASE_URL = os.environ.get("IVCAP_BASE_URL", "http://ivcap.local")
 IVCAP_SERVICE_TIMEOUT = 5
+TOOL_RESOLVE_CONCURRENCY = int(os.environ.get("TOOL_RESOLVE_CONCURRENCY", 8))
 
 logger = logging.getLogger("ivcap-tool")
 
@@ -33,6 +45,7 @@ class ToolDefinition(BaseModel):
     description: str
     fn_signature: str
     fn_schema: dict
+    cacheable: bool = Field(False, description="Calls with the same arguments always return the same result")
 
     model_config = ConfigDict(populate_by_name=True) # Allow using `service_id`
 
@@ -40,8 +53,11 @@ class ToolDefinition(BaseModel):
 override_fns: dict[str, Callable[..., Any]] = {}
 tools: dict[str, BaseTool] = {}
 builtinTools: set[FunctionTool] = set()
+tool_cache = ToolCache() # tools resolved from IVCAP or local URLs
 
 def resolve_tool(urn: str) -> BaseTool:
+    """Synchronous version of `aresolve_tool` for use outside of an event loop
+    (scripts, debugging). Service code should always use `resolve_tools`."""
     if urn in tools:
         return tools[urn]
 
@@ -56,6 +72,33 @@ def resolve_tool(urn: str) -> BaseTool:
 
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Tool '{urn}' not found\n")
 
+async def resolve_tools(urns: List[str]) -> List[BaseTool]:
+    """Resolve all tools in 'urns' concurrently, returning them in the same order.
+    At most TOOL_RESOLVE_CONCURRENCY definitions are fetched at the same time."""
+    return list(await asyncio.gather(*[aresolve_tool(urn) for urn in urns]))
+
+async def aresolve_tool(urn: str) -> BaseTool:
+    if urn in tools:
+        return tools[urn]
+
+    if not (urn.startswith("http://localhost") or urn.startswith("urn:ivcap:service:")):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Tool '{urn}' not found\n")
+
+    entry = tool_cache.get(urn)
+    if entry is not None and not entry.is_expired():
+        if entry.is_negative:
+            tool_cache.negative_hits += 1
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=entry.error)
+        tool_cache.hits += 1
+        if entry.needs_refresh() and urn not in _pending_resolves:
+            # refresh in the background, but keep serving the current definition
+            tool_cache.refreshes += 1
+            _start_fetch(urn, entry)
+        return entry.tool
+
+    tool_cache.misses += 1
+    return await asyncio.shield(_start_fetch(urn, entry))
+
 def load_tool_from_json_file(file_path: str) -> FunctionTool:
     with open(file_path, 'r') as file:
         j = json.load(file)
@@ -69,122 +112,49 @@ def load_local_url_tool(url: str, file_path: str) -> FunctionTool:
         return register_url_tool(url, j)
 
 def load_ivcap_tool(urn: str) -> FunctionTool:
-    # "GET", "path": "/1/aspects?include-content=false&limit=10&schema=urn"
-    base_url = IVCAP_BASE_URL
-    params = {
-        "schema": "urn:sd-core:schema:ai-tool.1",
-        "entity": urn,
-        "limit": 1,
-        "include-content": "true",
-    }
-    url = urljoin(base_url, "/1/aspects") + "?" + urlencode(params)
+    url = _ivcap_aspect_url(urn)
     try:
         response = requests.get(url)
         if response.status_code != 200:
             raise Exception(f"fetching description for IVCAP tool failed - {response}")
-
-        items = response.json().get("items", [])
-        if len(items) != 1:
-            raise Exception(f"cannot find description for IVCAP tool '{urn}'")
-        tool_def = items[0].get("content")
-        tool = register_url_tool(urljoin(base_url, f"/1/services2/{urn}/jobs"), tool_def)
-        return tool
+        tool_def = _tool_def_from_aspects(urn, response.json())
+        return register_url_tool(_ivcap_job_url(urn), tool_def, urn)
     except requests.exceptions.RequestException as e:
         print("An error occurred:", e)
 
-def register_url_tool(url: str, description: dict) -> FunctionTool:
-    md = _load_meta_from_json(description)
-
-    async def afn(**kwargs):
-        span_id = ToolEvent.dispatch_tool_start(md.name, **kwargs)
-        if kwargs.get("properties") and kwargs.get("type") == "object":
-            err = TypeError("arguments are of wrong type and format")
-            ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
-            raise err
-        p = md.fn_schema(**kwargs)
-        j = p.model_dump()
-        if "$schema" in j and j.get("$schema") == None:
-            # $schema are not always set properly
-            del j["$schema"]
-        async with httpx.AsyncClient() as client:
-            try:
-                headers = { "Timeout": str(IVCAP_SERVICE_TIMEOUT) }
-                logger.info(f"Calling tool {md.name} with {j}")
-                response = await client.post(url, json=j, timeout=2 * IVCAP_SERVICE_TIMEOUT, headers=headers)
-                response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-                result = response.json()
-                if response.status_code == 202:
-                    # retry again until result is ready
-                    result = await wait_for_result(result, span_id, **kwargs)
-                logger.info(f"Tool {md.name} returned successfully")
-                ToolEvent.dispatch_tool_end(span_id, result, md.name, **kwargs)
-                return result
-
-            except httpx.HTTPStatusError as e:
-                err = HTTPException(status_code=e.response.status, detail="tool reply")
-                logger.info(f"Tool {md.name} failed with {e}")
-                ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
-                raise err
-            # except httpx.RequestError as e:
-            #     print(f"Request error: {e}")
-            #     return None
-            except Exception as e:
-                logger.info(f"Tool {md.name} failed with {e}")
-                ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
-                raise e
-
-    async def wait_for_result(d: Dict, span_id, **kwargs):
-        location = d.get("location")
-        delay = d.get("retry-later", 10)
-        url = location + "?" + urlencode({"with-result-content": "true"})
-        while True:
-            logger.info(f"Waiting {delay}sec for result for tool {md.name} - {location}")
-            await asyncio.sleep(delay)
-            async with httpx.AsyncClient() as client:
-                try:
-                    headers = { "Timeout": str(IVCAP_SERVICE_TIMEOUT) }
-                    logger.info(f"Fetching result for tool {md.name} - {location}")
-                    response = await client.get(url, timeout=2 * IVCAP_SERVICE_TIMEOUT, headers=headers)
-                    response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-                    job = response.json()
-                    logger.info(f"... result {response.status_code} - {job}")
-                    if response.status_code == 200:
-                        status = job.get("status")
-                        if status == "succeeded":
-                            content = job.get("result-content")
-                            return content
-
-                except httpx.HTTPStatusError as e:
-                    logger.info(f"Tool {md.name} failed with {e}")
-                    err = HTTPException(status_code=e.response.status, detail="tool reply")
-                    ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
-                    raise err
-                except Exception as e:
-                    logger.info(f"Tool {md.name} failed with {e}")
-                    ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
-                    raise e
-
-    tool = FunctionTool(metadata=md, async_fn=afn)
-    return _register_function_tool(tool)
-
-def register_builtin_tool(fn: Callable[..., Any]) -> FunctionTool:
+def register_url_tool(url: str, description: dict, urn: Optional[str] = None) -> FunctionTool:
+    return _register_function_tool(_create_url_tool(url, description, urn))
+
+def register_builtin_tool(
+    fn: Callable[..., Any],
+    deterministic: bool = False,
+    execution: ExecutionClass = ExecutionClass.Inline,
+) -> FunctionTool:
+    """Register 'fn' as builtin tool. The results of a 'deterministic' tool
+    (same arguments, same result, no side effects) are memoized. When called
+    by an agent, 'fn' is executed according to 'execution' (see executors.py),
+    a 'process' tool needs to be a picklable (module level) function."""
     tool = FunctionTool.from_defaults(fn=fn)
-    tool._fn = _wrap(tool.metadata.name, fn)
+    tool._fn = _wrap(tool.metadata.name, fn, deterministic)
+    tool._async_fn = _awrap(tool.metadata.name, fn, deterministic, execution)
+    if deterministic:
+        _deterministic_builtins.add(tool.metadata.name)
     builtinTools.add(tool)
-    name = f"urn:sd-core:llama.builtin.{tool.metadata.name}"
+    name = BUILTIN_URN_PREFIX + tool.metadata.name
     return _register_function_tool(tool, name)
 
 def tool_to_ivcap_definition(tool: FunctionTool) -> ToolDefinition:
     md = tool.metadata
     sig, description = md.description.split("\n", 1)
-    id = f"urn:sd-core:llama.builtin.{md.name}"
+    id = BUILTIN_URN_PREFIX + md.name
     return ToolDefinition(
         name=md.name,
         id=id,
         service_id=id,
         description=description,
         fn_signature=sig,
-        fn_schema=md.fn_schema.model_json_schema()
+        fn_schema=md.fn_schema.model_json_schema(),
+        cacheable=md.name in _deterministic_builtins,
     )
 
 def dump_builtin_ivcap_definitions(dir: str = "ivcap"):
@@ -198,6 +168,178 @@ def dump_builtin_ivcap_definitions(dir: str = "ivcap"):
 
 ### INTERNAL
 
+_pending_resolves: dict[str, asyncio.Future] = {}
+_deterministic_builtins: set[str] = set()
+_resolve_semaphore: Optional[asyncio.Semaphore] = None
+
+def _start_fetch(urn: str, prev: Optional[CacheEntry]) -> asyncio.Future:
+    # share a single in-flight fetch between all concurrent requests for the same tool
+    fut = _pending_resolves.get(urn)
+    if fut is None:
+        fut = asyncio.ensure_future(_fetch_tool(urn, prev))
+        _pending_resolves[urn] = fut
+        def done(f: asyncio.Future):
+            _pending_resolves.pop(urn, None)
+            if not f.cancelled():
+                f.exception() # avoid 'exception never retrieved' for background refreshes
+        fut.add_done_callback(done)
+    return fut
+
+async def _fetch_tool(urn: str, prev: Optional[CacheEntry]) -> BaseTool:
+    global _resolve_semaphore
+    if _resolve_semaphore is None:
+        _resolve_semaphore = asyncio.Semaphore(TOOL_RESOLVE_CONCURRENCY)
+    if prev is not None and prev.is_negative:
+        prev = None
+    is_local = _is_local_tool(urn)
+    url = urn if is_local else _ivcap_aspect_url(urn)
+    async with _resolve_semaphore:
+        try:
+            headers = {}
+            if prev is not None and prev.etag:
+                headers["If-None-Match"] = prev.etag
+            response = await http_client.get(url, headers=headers, timeout=2 * IVCAP_SERVICE_TIMEOUT)
+            if response.status_code == 304 and prev is not None:
+                tool_cache.revalidated(prev)
+                return prev.tool
+            if response.status_code == 404:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Tool '{urn}' not found\n")
+            if response.status_code != 200:
+                raise Exception(f"fetching description for tool '{urn}' failed - {response}")
+            tool_def = response.json() if is_local else _tool_def_from_aspects(urn, response.json())
+            if prev is not None and prev.definition == tool_def:
+                tool = prev.tool
+            else:
+                tool = _create_url_tool(_tool_url(urn), tool_def, urn)
+        except HTTPException as e:
+            tool_cache.put_negative(urn, e.detail)
+            raise e
+        except Exception as e:
+            if prev is None:
+                raise e
+            # keep serving the last known definition and try again soon
+            logger.warning(f"refreshing definition for tool '{urn}' failed - {e}")
+            prev.touch(tool_cache.negative_ttl)
+            return prev.tool
+    tool_cache.put(urn, tool, tool_def, response.headers.get("etag"))
+    return tool
+
+def _create_url_tool(url: str, description: dict, urn: Optional[str] = None) -> FunctionTool:
+    md, fn_schema = _load_definition_from_json(description)
+    cacheable = tool_memo.is_cacheable(md.name, description)
+    # timings are kept per tool URN (or URL), as names are only unique within a request
+    tool_id = urn or url
+
+    async def afn(**kwargs):
+        await streaming.wait_for_consumer()
+        span_id = ToolEvent.dispatch_tool_start(md.name, **kwargs)
+        if kwargs.get("properties") and kwargs.get("type") == "object":
+            err = TypeError("arguments are of wrong type and format")
+            ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
+            raise err
+        p = fn_schema.validate(kwargs)
+        j = p.model_dump(mode="json")
+        if "$schema" in j and j.get("$schema") == None:
+            # $schema are not always set properly
+            del j["$schema"]
+        memo_key = tool_memo.call_key(url, j) if cacheable else None
+        if memo_key is not None:
+            result = tool_memo.results.get(memo_key)
+            if result is not tool_memo.MISSING:
+                ToolEvent.dispatch_tool_cached(span_id, result, md.name, **kwargs)
+                return result
+        callback_token, callback_headers = job_wait.create_callback()
+        started = time.perf_counter()
+        failed = True
+        try:
+            headers = { "Timeout": str(IVCAP_SERVICE_TIMEOUT), **callback_headers }
+            logger.info(f"Calling tool {md.name} with {j}")
+            with timings.phase("tool_http", tool_id):
+                response = await http_client.post(url, json=j, timeout=2 * IVCAP_SERVICE_TIMEOUT, headers=headers)
+            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+            result = response.json()
+            if response.status_code == 202:
+                # retry again until result is ready
+                with timings.phase("job_wait", tool_id):
+                    result = await wait_for_result(result, response, span_id, callback_token, **kwargs)
+            logger.info(f"Tool {md.name} returned successfully")
+            if memo_key is not None:
+                tool_memo.results.put(memo_key, result, tool_memo.TOOL_MEMO_TTL)
+            ToolEvent.dispatch_tool_end(span_id, result, md.name, **kwargs)
+            failed = False
+            return result
+
+        except httpx.HTTPStatusError as e:
+            err = HTTPException(status_code=e.response.status_code, detail="tool reply")
+            logger.info(f"Tool {md.name} failed with {e}")
+            ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
+            raise err
+        except HTTPException as e:
+            raise e # already reported by 'wait_for_result'
+        except Exception as e:
+            logger.info(f"Tool {md.name} failed with {e}")
+            ToolEvent.dispatch_tool_error(span_id, e, md.name, **kwargs)
+            raise e
+        finally:
+            job_wait.release_callback(callback_token)
+            timings.record("tool", time.perf_counter() - started, tool_id, failed)
+
+    async def wait_for_result(d: Dict, response: httpx.Response, span_id, callback_token, **kwargs):
+        # 'retry-later' in the body is a conservative default, start polling
+        # early unless the server explicitly asks us to wait
+        location = d.get("location") or response.headers.get("location")
+        try:
+            return await job_wait.wait_for_job(
+                location,
+                md.name,
+                deadline=job_wait.deadline_for(md.name),
+                retry_after=job_wait.retry_after(response),
+                callback_token=callback_token,
+            )
+        except httpx.HTTPStatusError as e:
+            logger.info(f"Tool {md.name} failed with {e}")
+            err = HTTPException(status_code=e.response.status_code, detail="tool reply")
+        except job_wait.JobTimeoutError as e:
+            logger.info(f"Tool {md.name} failed with {e}")
+            err = HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+        except job_wait.JobWaitError as e:
+            logger.info(f"Tool {md.name} failed with {e}")
+            err = HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+        except Exception as e:
+            logger.info(f"Tool {md.name} failed with {e}")
+            ToolEvent.dispatch_tool_error(span_id, e, md.name, **kwargs)
+            raise e
+        ToolEvent.dispatch_tool_error(span_id, err, md.name, **kwargs)
+        raise err
+
+    return FunctionTool(metadata=md, async_fn=afn)
+
+def _is_local_tool(urn: str) -> bool:
+    # for debugging we support loading metadata from local tools
+    return urn.startswith("http://localhost")
+
+def _tool_url(urn: str) -> str:
+    return urn if _is_local_tool(urn) else _ivcap_job_url(urn)
+
+def _ivcap_aspect_url(urn: str) -> str:
+    # "GET", "path": "/1/aspects?include-content=false&limit=10&schema=urn"
+    params = {
+        "schema": "urn:sd-core:schema:ai-tool.1",
+        "entity": urn,
+        "limit": 1,
+        "include-content": "true",
+    }
+    return urljoin(IVCAP_BASE_URL, "/1/aspects") + "?" + urlencode(params)
+
+def _ivcap_job_url(urn: str) -> str:
+    return urljoin(IVCAP_BASE_URL, f"/1/services2/{urn}/jobs")
+
+def _tool_def_from_aspects(urn: str, reply: dict) -> dict:
+    items = reply.get("items", [])
+    if len(items) != 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"cannot find description for IVCAP tool '{urn}'\n")
+    return items[0].get("content")
+
 def _register_function_tool(tool: FunctionTool, name: Optional[str]=None) -> FunctionTool:
     if not name:
         name = tool.metadata.name
@@ -206,11 +348,42 @@ def _register_function_tool(tool: FunctionTool, name: Optional[str]=None) -> Fun
         tools["urn:ivcap:service:ai-tool." + name] = tool
     return tool
 
-def _wrap(name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+def _wrap(name: str, fn: Callable[..., Any], deterministic: bool = False) -> Callable[..., Any]:
     def w(**kwargs):
         try:
             span_id = ToolEvent.dispatch_tool_start(name, **kwargs)
-            data = fn(**kwargs)
+            if deterministic:
+                memo_key = tool_memo.call_key(BUILTIN_URN_PREFIX + name, kwargs)
+                data = tool_memo.results.get(memo_key)
+                if data is not tool_memo.MISSING:
+                    ToolEvent.dispatch_tool_cached(span_id, data, name, **kwargs)
+                    return data
+            with timings.phase("tool", BUILTIN_URN_PREFIX + name):
+                data = fn(**kwargs)
+            if deterministic:
+                tool_memo.results.put(memo_key, data)
+            ToolEvent.dispatch_tool_end(span_id, data, name, **kwargs)
+            return data
+        except Exception as e: # Catch any other error
+            ToolEvent.dispatch_tool_error(span_id, e, name, **kwargs)
+            raise e
+    return w
+
+def _awrap(name: str, fn: Callable[..., Any], deterministic: bool, execution: ExecutionClass) -> Callable[..., Awaitable[Any]]:
+    async def w(**kwargs):
+        await streaming.wait_for_consumer()
+        try:
+            span_id = ToolEvent.dispatch_tool_start(name, **kwargs)
+            if deterministic:
+                memo_key = tool_memo.call_key(BUILTIN_URN_PREFIX + name, kwargs)
+                data = tool_memo.results.get(memo_key)
+                if data is not tool_memo.MISSING:
+                    ToolEvent.dispatch_tool_cached(span_id, data, name, **kwargs)
+                    return data
+            with timings.phase("tool", BUILTIN_URN_PREFIX + name):
+                data = await executors.run(execution, fn, kwargs)
+            if deterministic:
+                tool_memo.results.put(memo_key, data)
             ToolEvent.dispatch_tool_end(span_id, data, name, **kwargs)
             return data
         except Exception as e: # Catch any other error
@@ -219,10 +392,10 @@ def _wrap(name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
     return w
 
 def _load_tool_from_json(d: dict) -> FunctionTool:
-    md = _load_meta_from_json(d)
+    md, fn_schema = _load_definition_from_json(d)
 
     def tool_proxy(**kwargs):
-        md.fn_schema(**kwargs) # verify what's being passed in
+        fn_schema.validate(kwargs) # verify what's being passed in
         if md.name in override_fns:
             return override_fns[md.name](**kwargs)
 
@@ -232,6 +405,10 @@ def _load_tool_from_json(d: dict) -> FunctionTool:
     return _register_function_tool(tool)
 
 def _load_meta_from_json(d: dict) -> ToolMetadata:
+    md, _ = _load_definition_from_json(d)
+    return md
+
+def _load_definition_from_json(d: dict) -> tuple[ToolMetadata, CompiledSchema]:
     try:
         td = ToolDefinition(**d)
     except Exception as e:
@@ -240,73 +417,19 @@ def _load_meta_from_json(d: dict) -> ToolMetadata:
 
     if td.jschema != TOOL_SCHEMA:
         raise ValueError(f"Invalid schema: expected \'{TOOL_SCHEMA}\' but got \'{td.jschema}\'")
-    fn_schema = _create_pydantic_model_from_schema(td.fn_schema, td.name)
+    fn_schema = compile_schema(td.fn_schema, td.name)
 
     md = ToolMetadata(
         name=td.name,
         description=f"{td.fn_signature}\n{td.description}",
-        fn_schema=fn_schema,
+        fn_schema=fn_schema.model,
     )
-    return md
+    return md, fn_schema
 
 
 def _create_pydantic_model_from_schema(schema: dict, model_name: str) -> Any:
     """Creates a Pydantic model from a JSON schema definition."""
-    fields = {}
-    for field_name, field_schema in schema.get("properties", {}).items():
-        field_type = field_schema.get("type")
-        required = field_name in schema.get("required", [])
-
-        # Handle different JSON schema types and map them to Python types
-        if field_type == "string":
-            python_type = str
-        elif field_type == "integer":
-            python_type = int
-        elif field_type == "number":
-            python_type = float
-        elif field_type == "boolean":
-            python_type = bool
-        elif field_type == "array":
-            items_type = field_schema.get("items", {}).get("type")
-            if items_type == "string":
-                python_type = List[str]
-            elif items_type == "integer":
-                python_type = List[int]
-            elif items_type == "number":
-                python_type = List[float]
-            elif items_type == "boolean":
-                python_type = List[bool]
-            elif "properties" in field_schema.get("items", {}): #nested object
-                nested_model_name = model_name + "_" + field_name.capitalize()
-                nested_model = _create_pydantic_model_from_schema(field_schema["items"], nested_model_name)
-                python_type = List[nested_model]
-            else:
-                python_type = List[Any]  # Default to List[Any] if item type is not specified
-        elif field_type == "object":
-            nested_model_name = model_name + "_" + field_name.capitalize()
-            python_type = _create_pydantic_model_from_schema(field_schema, nested_model_name)
-
-        else:
-            python_type = Any  # Default to Any if type is unknown
-
-        # Handle optional fields
-        if not required:
-            python_type = Optional[python_type]
-
-        #Create Field with extra information
-        field_kwargs = {}
-        if "description" in field_schema:
-            field_kwargs["description"] = field_schema["description"]
-        if "minimum" in field_schema:
-            field_kwargs["ge"] = field_schema["minimum"]
-        if "maximum" in field_schema:
-            field_kwargs["le"] = field_schema["maximum"]
-        if "pattern" in field_schema:
-            field_kwargs["regex"] = field_schema["pattern"]
-
-        fields[field_name] = (python_type, Field(**field_kwargs) if field_kwargs else None)
-
-    return create_model(model_name, **fields)
+    return compile_schema(schema, model_name).model
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,109 @@
+#
+# Direct tool invocation, bypassing the agent (and therefore the LLM).
+#
+# Callers which already know the tool and its arguments can call it through
+# 'POST /tools/invoke', or call many tools at once through 'POST /tools/batch'.
+# Tools are resolved and executed exactly as they are for an agent, so the
+# tool caches, memoization and executors all apply.
+#
+import asyncio
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, Field, ValidationError
+
+import job_wait
+from tool import aresolve_tool
+
+logger = logging.getLogger("tool-api")
+
+# max. number of concurrent tool calls of a batch
+TOOL_BATCH_CONCURRENCY = int(os.environ.get("TOOL_BATCH_CONCURRENCY", 16))
+TOOL_BATCH_MAX_SIZE = int(os.environ.get("TOOL_BATCH_MAX_SIZE", 1000))
+
+class ToolInvocation(BaseModel):
+    jschema: str = Field("urn:sd-core:schema.llama-agent.tool-invocation.1", alias="$schema")
+    tool: str = Field(description="URN of the tool to call", examples=["urn:sd-core:llama.builtin.mulInt"])
+    args: Dict[str, Any] = Field({}, description="The arguments to call the tool with", examples=[{"a": 5, "b": 2}])
+    job_deadline: Optional[float] = Field(None, description="Max. time in seconds to wait for the result of a remote tool")
+
+class ToolResult(BaseModel):
+    jschema: str = Field("urn:sd-core:schema.llama-agent.tool-result.1", alias="$schema")
+    tool: str = Field(description="URN of the tool called")
+    result: Optional[Any] = Field(None, description="What the tool returned")
+
+class ToolBatchRequest(BaseModel):
+    jschema: str = Field("urn:sd-core:schema.llama-agent.tool-batch.1", alias="$schema")
+    invocations: List[ToolInvocation] = Field(description="The tool calls to execute", max_length=TOOL_BATCH_MAX_SIZE)
+    max_concurrency: Optional[int] = Field(None, gt=0, description="Max. number of tool calls executed at the same time")
+
+class ToolBatchItem(BaseModel):
+    index: int = Field(description="Position of the invocation in the request")
+    tool: str = Field(description="URN of the tool called")
+    status: int = Field(description="HTTP status code the call would have had on its own")
+    result: Optional[Any] = Field(None, description="What the tool returned (if successful)")
+    error: Optional[Any] = Field(None, description="Why the call failed (if not successful)")
+
+class ToolBatchResponse(BaseModel):
+    jschema: str = Field("urn:sd-core:schema.llama-agent.tool-batch-result.1", alias="$schema")
+    results: List[ToolBatchItem] = Field(description="The outcome of every invocation, in the order requested")
+
+async def invoke_tool(inv: ToolInvocation) -> ToolResult:
+    """Call a single tool directly with the given arguments (served as 'POST /tools/invoke')"""
+    result = await call_tool(inv.tool, inv.args, inv.job_deadline)
+    return ToolResult(tool=inv.tool, result=result)
+
+async def invoke_tools(req: ToolBatchRequest) -> ToolBatchResponse:
+    """Call many tools concurrently (served as 'POST /tools/batch'). A failing
+    call doesn't fail the batch, but is reported with its own status and error."""
+    limit = asyncio.Semaphore(req.max_concurrency or TOOL_BATCH_CONCURRENCY)
+
+    async def run(index: int, inv: ToolInvocation) -> ToolBatchItem:
+        async with limit:
+            try:
+                result = await call_tool(inv.tool, inv.args, inv.job_deadline)
+                return ToolBatchItem(index=index, tool=inv.tool, status=status.HTTP_200_OK, result=result)
+            except HTTPException as e:
+                return ToolBatchItem(index=index, tool=inv.tool, status=e.status_code, error=e.detail)
+            except Exception as e:
+                logger.warning(f"call {index} of batch to tool '{inv.tool}' failed - {e}")
+                return ToolBatchItem(index=index, tool=inv.tool, status=status.HTTP_500_INTERNAL_SERVER_ERROR, error=str(e))
+
+    results = await asyncio.gather(*[run(i, inv) for i, inv in enumerate(req.invocations)])
+    return ToolBatchResponse(results=results)
+
+async def call_tool(urn: str, args: Dict[str, Any], job_deadline: Optional[float] = None) -> Any:
+    """Resolve 'urn', validate 'args' against its schema, and call it.
+    All failures are reported as HTTPException."""
+    try:
+        tool = await aresolve_tool(urn)
+    except HTTPException:
+        raise # e.g. unknown tool
+    except Exception as e:
+        # IVCAP (or the tool's server) is unreachable or failed
+        logger.info(f"resolving tool '{urn}' failed - {e}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Resolving tool '{urn}' failed - {type(e).__name__}: {e}")
+    fn_schema = tool.metadata.fn_schema
+    if fn_schema is not None:
+        # the tool gets the same arguments as when called by an agent, this
+        # only reports invalid arguments before the tool is even called
+        try:
+            fn_schema.model_validate(args)
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=e.errors(include_url=False, include_context=False),
+            )
+    deadline_token = job_wait.set_request_deadline(job_deadline)
+    try:
+        output = await tool.acall(**args)
+    except HTTPException:
+        raise # already mapped by the tool, e.g. failed remote job
+    except Exception as e:
+        logger.info(f"direct call of tool '{urn}' failed - {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{type(e).__name__}: {e}")
+    finally:
+        job_wait.reset_request_deadline(deadline_token)
+    return output.raw_output
@@ -0,0 +1,147 @@
+#
+# Cache for tool definitions resolved from IVCAP (or local debug URLs).
+#
+# Every entry has its own expiry. Entries which are close to expiring are
+# refreshed in the background, and failed lookups are cached for a much
+# shorter time so mistyped URNs do not hit IVCAP on every request.
+#
+from collections import OrderedDict
+import os
+import time
+from typing import Any, Optional
+
+from llama_index.core.tools import BaseTool
+
+TOOL_CACHE_TTL = float(os.environ.get("TOOL_CACHE_TTL", 300))
+TOOL_CACHE_NEGATIVE_TTL = float(os.environ.get("TOOL_CACHE_NEGATIVE_TTL", 30))
+TOOL_CACHE_MAX_SIZE = int(os.environ.get("TOOL_CACHE_MAX_SIZE", 1000))
+# fraction of TTL after which an entry is refreshed in the background
+TOOL_CACHE_REFRESH_AHEAD = float(os.environ.get("TOOL_CACHE_REFRESH_AHEAD", 0.8))
+
+class CacheEntry:
+    __slots__ = ("urn", "tool", "definition", "etag", "fetched_at", "expires_at", "refresh_at", "error")
+
+    def __init__(
+        self,
+        urn: str,
+        tool: Optional[BaseTool],
+        definition: Optional[dict],
+        etag: Optional[str],
+        ttl: float,
+        error: Optional[str] = None,
+    ):
+        self.urn = urn
+        self.tool = tool
+        self.definition = definition
+        self.etag = etag
+        self.error = error
+        self.touch(ttl)
+
+    @property
+    def is_negative(self) -> bool:
+        return self.tool is None
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) >= self.expires_at
+
+    def needs_refresh(self, now: Optional[float] = None) -> bool:
+        if self.is_negative:
+            return False
+        return (now or time.monotonic()) >= self.refresh_at
+
+    def touch(self, ttl: float):
+        """Extend the lifetime of an entry, e.g. after a successful revalidation"""
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + ttl
+        self.refresh_at = self.fetched_at + ttl * TOOL_CACHE_REFRESH_AHEAD
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+class ToolCache:
+    """LRU cache of resolved tools with per-entry TTL and negative caching"""
+
+    def __init__(
+        self,
+        max_size: int = TOOL_CACHE_MAX_SIZE,
+        ttl: float = TOOL_CACHE_TTL,
+        negative_ttl: float = TOOL_CACHE_NEGATIVE_TTL,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.revalidations = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def get(self, urn: str) -> Optional[CacheEntry]:
+        """Return the entry for 'urn', even if expired, and mark it as recently used"""
+        entry = self._entries.get(urn)
+        if entry is not None:
+            self._entries.move_to_end(urn)
+        return entry
+
+    def put(self, urn: str, tool: BaseTool, definition: Optional[dict], etag: Optional[str] = None) -> CacheEntry:
+        entry = CacheEntry(urn, tool, definition, etag, self.ttl)
+        self._set(urn, entry)
+        return entry
+
+    def put_restored(self, urn: str, tool: BaseTool, definition: dict, etag: Optional[str], age: float) -> CacheEntry:
+        """Add an entry restored from a snapshot which was fetched 'age' seconds ago.
+        It is served right away, but refreshed in the background on first use."""
+        entry = CacheEntry(urn, tool, definition, etag, max(self.ttl - age, self.negative_ttl))
+        entry.fetched_at -= age
+        entry.refresh_at = time.monotonic()
+        self._set(urn, entry)
+        return entry
+
+    def put_negative(self, urn: str, error: str) -> CacheEntry:
+        entry = CacheEntry(urn, None, None, None, self.negative_ttl, error=error)
+        self._set(urn, entry)
+        return entry
+
+    def revalidated(self, entry: CacheEntry):
+        self.revalidations += 1
+        entry.touch(self.ttl)
+
+    def remove(self, urn: str):
+        self._entries.pop(urn, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, urn: str) -> bool:
+        return urn in self._entries
+
+    def entries(self) -> list[CacheEntry]:
+        return list(self._entries.values())
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses + self.negative_hits
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "negative": sum(1 for e in self._entries.values() if e.is_negative),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups > 0 else 0,
+            "revalidations": self.revalidations,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+        }
+
+    def _set(self, urn: str, entry: CacheEntry):
+        self._entries[urn] = entry
+        self._entries.move_to_end(urn)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,83 @@
+#
+# Memoization of tool calls.
+#
+# Tools marked as deterministic (builtins registered with 'deterministic=True',
+# remote tools whose definition sets 'cacheable' or which are listed in
+# TOOL_MEMO_TOOLS) return the same result for the same arguments. Their
+# results are kept in a bounded LRU keyed by tool (URN or URL) and canonical
+# arguments.
+#
+from collections import OrderedDict
+import json
+import os
+import time
+from typing import Any, Optional
+
+TOOL_MEMO_MAX_SIZE = int(os.environ.get("TOOL_MEMO_MAX_SIZE", 4096))
+# how long (in seconds) results of remote tools are kept, builtin results never expire
+TOOL_MEMO_TTL = float(os.environ.get("TOOL_MEMO_TTL", 3600))
+# names of remote tools to treat as cacheable, e.g. TOOL_MEMO_TOOLS="geocode,lookup_species"
+memo_tools: set[str] = {n.strip() for n in os.environ.get("TOOL_MEMO_TOOLS", "").split(",") if n.strip()}
+
+MISSING = object()
+
+class ResultCache:
+    """LRU cache of tool results with optional per-entry TTL"""
+
+    def __init__(self, max_size: int = TOOL_MEMO_MAX_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[tuple[str, str], tuple[Optional[float], Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple[str, str]) -> Any:
+        """Returns the cached result for 'key', or MISSING (results may well be None)"""
+        e = self._entries.get(key)
+        if e is not None:
+            expires_at, result = e
+            if expires_at is None or time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+        self.misses += 1
+        return MISSING
+
+    def put(self, key: tuple[str, str], result: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            "evictions": self.evictions,
+        }
+
+def call_key(tool_id: str, args: dict[str, Any]) -> tuple[str, str]:
+    """Returns the cache key for calling the tool 'tool_id' with 'args'. As
+    different services (or a service and a builtin) may well expose tools of
+    the same name, 'tool_id' needs to identify the tool itself, i.e. the URN of
+    a builtin or the job URL of a remote tool."""
+    return (tool_id, json.dumps(args, sort_keys=True, separators=(",", ":"), default=str))
+
+def is_cacheable(tool_name: str, definition: dict) -> bool:
+    """Returns true if the results of the remote tool with 'definition' can be memoized"""
+    return bool(definition.get("cacheable")) or tool_name in memo_tools
+
+def stats() -> dict[str, Any]:
+    return results.stats()
+
+# cached results are shared between all callers, which must not modify them
+results = ResultCache()
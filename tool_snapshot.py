@@ -0,0 +1,120 @@
+#
+# Persists the definitions of all resolved tools to a local file, so a newly
+# started runner can rebuild its tool cache without contacting IVCAP first.
+#
+import asyncio
+import json
+import os
+import logging
+import time
+from typing import List, Optional
+
+import tool
+from tool import tool_cache
+
+logger = logging.getLogger("tool-snapshot")
+
+SNAPSHOT_VERSION = 1
+# interval in seconds between two snapshots
+TOOL_SNAPSHOT_INTERVAL = float(os.environ.get("TOOL_SNAPSHOT_INTERVAL", 300))
+# definitions older than this (in seconds) are not restored
+TOOL_SNAPSHOT_MAX_AGE = float(os.environ.get("TOOL_SNAPSHOT_MAX_AGE", 24 * 3600))
+
+_snapshot_task: Optional[asyncio.Task] = None
+
+def save_snapshot(path: str) -> int:
+    """Write all (positive) cache entries to 'path'. Returns the number of tools saved."""
+    now = time.time()
+    items = []
+    for e in tool_cache.entries():
+        if e.is_negative or e.definition is None:
+            continue
+        items.append({
+            "urn": e.urn,
+            "definition": e.definition,
+            "etag": e.etag,
+            "fetched_at": now - e.age,
+        })
+    snapshot = {"version": SNAPSHOT_VERSION, "saved_at": now, "tools": items}
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as file:
+        json.dump(snapshot, file, separators=(",", ":"))
+    os.replace(tmp, path) # never leave a half written snapshot behind
+    return len(items)
+
+def load_snapshot(path: str, max_age: float = TOOL_SNAPSHOT_MAX_AGE) -> int:
+    """Restore tools from the snapshot at 'path'. Returns the number of tools restored."""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, 'r') as file:
+            snapshot = json.load(file)
+    except Exception as e:
+        logger.warning(f"cannot read tool snapshot '{path}' - {e}")
+        return 0
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        logger.warning(f"ignoring tool snapshot '{path}' with unsupported version '{snapshot.get('version')}'")
+        return 0
+
+    now = time.time()
+    count = 0
+    for item in snapshot.get("tools", []):
+        urn = item.get("urn")
+        age = now - item.get("fetched_at", 0)
+        if age > max_age or urn in tool_cache:
+            continue
+        try:
+            t = tool._create_url_tool(tool._tool_url(urn), item["definition"], urn)
+        except Exception as e:
+            logger.warning(f"cannot restore tool '{urn}' from snapshot - {e}")
+            continue
+        tool_cache.put_restored(urn, t, item["definition"], item.get("etag"), max(age, 0))
+        count += 1
+    return count
+
+async def preload_tools(urns: List[str]) -> int:
+    """Resolve all 'urns' so the first request using them doesn't have to.
+    Returns the number of tools successfully resolved."""
+    results = await asyncio.gather(*[tool.aresolve_tool(urn) for urn in urns], return_exceptions=True)
+    count = 0
+    for urn, r in zip(urns, results):
+        if isinstance(r, Exception):
+            logger.warning(f"cannot preload tool '{urn}' - {r}")
+        else:
+            count += 1
+    return count
+
+async def start(path: Optional[str], preload: Optional[List[str]] = None):
+    """Restore the tool cache from 'path' and warm it with the 'preload' tools.
+    Then periodically save a new snapshot to 'path'."""
+    global _snapshot_task
+    if path:
+        n = load_snapshot(path)
+        logger.info(f"Restored {n} tool definitions from '{path}'")
+    if preload:
+        n = await preload_tools(preload)
+        logger.info(f"Preloaded {n} of {len(preload)} tools")
+    if path and TOOL_SNAPSHOT_INTERVAL > 0:
+        _snapshot_task = asyncio.create_task(_snapshot_loop(path))
+
+async def stop(path: Optional[str]):
+    global _snapshot_task
+    if _snapshot_task is not None:
+        _snapshot_task.cancel()
+        _snapshot_task = None
+    if path:
+        _save(path)
+
+### INTERNAL
+
+async def _snapshot_loop(path: str):
+    while True:
+        await asyncio.sleep(TOOL_SNAPSHOT_INTERVAL)
+        _save(path)
+
+def _save(path: str):
+    try:
+        n = save_snapshot(path)
+        logger.debug(f"Saved {n} tool definitions to '{path}'")
+    except Exception as e:
+        logger.warning(f"cannot save tool snapshot to '{path}' - {e}")